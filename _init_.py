@@ -1,23 +1,62 @@
+import os
+import typing
 import azure.functions as func
 import logging
 from .beehiiv_database import (
     fetch_data_from_beehiiv_api,
-    create_db_rows,
+    iter_db_row_units,
     create_db_connection,
-    insert_db_data
+    start_sync_run,
+    stream_db_data,
+    list_sync_units,
+    create_work_items,
+    sync_unit,
+    reset_run_metrics,
+    emit_run_report
 )
 
-def main(timer: func.TimerRequest) -> None:
-    logging.info('Iniciando sincronización de datos de Beehiiv...')
+def main(timer: func.TimerRequest, workitems: func.Out[typing.List[str]]) -> None:
+    metrics = reset_run_metrics()
     
     try:
-        beehiiv_info = fetch_data_from_beehiiv_api()
-        rows = create_db_rows(beehiiv_info)
+        if os.environ.get('SYNC_FANOUT', 'false').lower() in ('1', 'true', 'yes'):
+            # Coordinador: un mensaje por publicación / cuenta en la cola sync-units; cada uno lo procesa worker
+            logging.info('Repartiendo la sincronización entre workers...')
+            with metrics.stage('run'):
+                items = create_work_items(list_sync_units())
+                workitems.set(items)
+            logging.info(f'{len(items)} unidades encoladas')
+            return
+
+        logging.info('Iniciando sincronización de datos de Beehiiv...')
+        # Cada publicación se escribe en la base apenas se descarga
         connection, cursor = create_db_connection()
-        insert_db_data(connection, cursor, rows)
+        # Con SYNC_CHECKPOINTS se retoma la última corrida fallida sin repetir lo ya cargado
+        run_id, completed_units = start_sync_run(connection, cursor)
+        beehiiv_units = fetch_data_from_beehiiv_api(stream=True, skip_publications=completed_units.get('beehiiv'))
+        with metrics.stage('run'):
+            stream_db_data(connection, cursor, iter_db_row_units(beehiiv_units=beehiiv_units), run_id=run_id)
         
         logging.info('Sincronización de Beehiiv completada exitosamente')
         
     except Exception as e:
         logging.error(f'Error en la sincronización: {str(e)}')
-        raise
\ No newline at end of file
+        raise
+    finally:
+        emit_run_report()
+
+def worker(item: func.QueueMessage) -> None:
+    metrics = reset_run_metrics()
+    unit = item.get_json()
+    logging.info(f"Sincronizando {unit['source']} {unit['unit_id']} (intento {item.dequeue_count})")
+    
+    try:
+        with metrics.stage('run'):
+            sync_unit(unit)
+        logging.info(f"Sincronización de {unit['source']} {unit['unit_id']} completada exitosamente")
+        
+    except Exception as e:
+        logging.error(f"Error en la sincronización de {unit['source']} {unit['unit_id']}: {str(e)}")
+        raise
+    finally:
+        emit_run_report()
\ No newline at end of file
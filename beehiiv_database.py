@@ -1,593 +1,85 @@
-import os
-import json
+import sys
 import time
-import logging
-import psycopg2
-import requests
-from datetime import datetime, timedelta, timezone
-from facebook_business.api import FacebookAdsApi
-from facebook_business.adobjects.business import Business
-from facebook_business.exceptions import FacebookRequestError
-
-def create_db_connection():
-    try:
-        connection = psycopg2.connect(
-            host=os.environ["DB_HOST"],
-            database=os.environ["DB_DATABASE"],
-            user=os.environ["DB_USER"],
-            password=os.environ["DB_PASSWORD"],
-            port=os.environ["DB_PORT"]
-        )
-        cursor = connection.cursor()
-        return connection, cursor
-    except Exception as e:
-        logging.error(f"Error connecting to database: {str(e)}")
-        raise
-
-def fetch_data_from_facebook_api(effective_status=['ACTIVE']):
-    app_id = os.environ["FACEBOOK_APP_ID"]
-    app_secret = os.environ["FACEBOOK_APP_SECRET"]
-    access_token = os.environ["FACEBOOK_ACCESS_TOKEN"]
-    business_id = os.environ["FACEBOOK_BUSINESS_ID"]
-
-    FacebookAdsApi.init(app_id, app_secret, access_token)
-
-    status_map = {
-        1: 'ACTIVE',
-        2: 'DISABLED',
-        3: 'UNSETTLED',
-        7: 'PENDING_RISK_REVIEW',
-        8: 'PENDING_SETTLEMENT',
-        9: 'IN_GRACE_PERIOD',
-        100: 'PENDING_CLOSURE',
-        101: 'CLOSED',
-        201: 'ANY_ACTIVE',
-        202: 'ANY_CLOSED'
-    }
-
-    def check_limit(response, use_response=True, account_number=None):
-        ad_account_usage = 0
-        business_usage = 0
-        app_usage = 0
-
-        if not use_response:
-            response = requests.get(f'https://graph.facebook.com/v20.0/act_{account_number}/insights?access_token={access_token}')
-        
-        headers = response._headers if hasattr(response, '_headers') else response.headers if not use_response else response._http_headers
-
-        if 'x-ad-account-usage' in headers:
-            ad_account_usage_data = json.loads(headers['x-ad-account-usage'])
-            ad_account_usage = float(ad_account_usage_data.get('acc_id_util_pct', 0))
-            reset_time_duration = ad_account_usage_data.get('reset_time_duration', 0)
-        
-        if 'x-business-use-case-usage' in headers:
-            business_usage_data = json.loads(headers['x-business-use-case-usage'])
-            for key, value in business_usage_data.items():
-                account_usage = value[0]
-                business_call = float(account_usage['call_count'])
-                business_cpu = float(account_usage['total_cputime'])
-                business_total = float(account_usage['total_time'])
-                estimated_time_to_regain_access = account_usage.get('estimated_time_to_regain_access', 0)
-                ads_api_access_tier = account_usage.get('ads_api_access_tier', 'UNKNOWN')
-                type = account_usage.get('type', 'UNKNOWN')
-                business_usage = max(business_call, business_cpu, business_total)
-
-        if 'x-fb-ads-insights-throttle' in headers:
-            insights_throttle_data = json.loads(headers['x-fb-ads-insights-throttle'])
-            app_usage = float(insights_throttle_data.get('app_id_util_pct', 0))
-            ad_account_usage = max(ad_account_usage, float(insights_throttle_data.get('acc_id_util_pct', 0)))
-        
-        if 'x-app-usage' in headers:
-            app_usage_data = json.loads(headers['x-app-usage'])
-            app_usage = max(app_usage, float(app_usage_data.get('call_count', 0)))
-
-        return max(ad_account_usage, business_usage, app_usage)
-
-    def api_call_with_retries(func, *args, **kwargs):
-        max_retries = 5
-        retry_count = 0
-        while retry_count < max_retries:
-            try:
-                response = func(*args, **kwargs)
-                usage = check_limit(response)
-                if usage >= 100:
-                    sleep_time = 60 * (2 ** retry_count)
-                    time.sleep(sleep_time)
-                    retry_count += 1
-                    continue
-                return response
-            except FacebookRequestError as e:
-                if e.api_error_code() in [17, 80004]:
-                    sleep_time = 60 * (2 ** retry_count)
-                    time.sleep(sleep_time)
-                    retry_count += 1
-                else:
-                    raise
-        raise Exception("Max retries exceeded")
-
-    def get_time_range(init_date):
-        return {
-            'since': init_date,
-            'until': datetime.now().strftime('%Y-%m-%d')
-        }
-
-    def get_ad_accounts_with_insights(business_id, init_date, add_insights=False):
-        business = Business(business_id)
-        
-        fields = ['id', 'name', 'currency', 'timezone_name', 'created_time']
-        params = {
-            'time_range': get_time_range(init_date),
-            'level': 'account'
-        }
-
-        insights_fields = ['spend', 'clicks', 'unique_clicks', 'cpc', 'ctr', 'impressions', 'reach']
-        insights_params = {
-            'location': {'breakdowns': ['region', 'country'], 'time_range': get_time_range(init_date)},
-            'audience': {'breakdowns': ['age', 'gender'], 'time_range': get_time_range(init_date)}
-        }
-
-        ad_accounts = list(api_call_with_retries(business.get_owned_ad_accounts, fields=fields))
-        ad_accounts_info = []
-
-        for ad_account in ad_accounts:
-            ad_account_data = ad_account.export_all_data()
-            if add_insights:
-                for key, value in insights_params.items():
-                    insights = api_call_with_retries(ad_account.get_insights, fields=insights_fields, params=value)
-                    if insights:
-                        ad_account_data[f'insights_{key}'] = [insight.export_all_data() for insight in insights]
-            ad_accounts_info.append(ad_account_data)
-
-        return ad_accounts, ad_accounts_info
-
-    def get_campaigns_with_insights(ad_account, init_date, effective_status=['ACTIVE'], add_insights=False):
-        fields = ['id', 'name', 'objective', 'status', 'created_time', 'start_time', 'stop_time', 'daily_budget', 'lifetime_budget']
-        params = {
-            'effective_status': effective_status,
-            'time_range': get_time_range(init_date),
-            'level': 'campaign'
-        }
-
-        insights_fields = ['spend', 'clicks', 'unique_clicks', 'cpc', 'ctr', 'impressions', 'reach']
-        insights_params = {
-            'location': {'breakdowns': ['region', 'country'], 'time_range': get_time_range(init_date)},
-            'audience': {'breakdowns': ['age', 'gender'], 'time_range': get_time_range(init_date)}
-        }
-
-        campaigns = list(api_call_with_retries(ad_account.get_campaigns, fields=fields, params=params))
-        campaigns_info = []
-
-        for campaign in campaigns:
-            campaign_data = campaign.export_all_data()
-            if add_insights:
-                for key, value in insights_params.items():
-                    insights = api_call_with_retries(campaign.get_insights, fields=insights_fields, params=value)
-                    if insights:
-                        campaign_data[f'insights_{key}'] = [insight.export_all_data() for insight in insights]
-            campaigns_info.append(campaign_data)
-
-        return campaigns, campaigns_info
-
-    def get_ad_sets_with_insights(campaigns, init_date, add_insights=False):
-        fields = [
-            'id', 'campaign_id', 'name', 'status', 'created_time', 'start_time', 'stop_time',
-            'daily_budget', 'lifetime_budget', 'bid_amount', 'bid_strategy', 'billing_event',
-            'optimization_goal', 'targeting'
-        ]
-        params = {
-            'time_range': get_time_range(init_date),
-            'level': 'adset'
-        }
-
-        insights_fields = ['spend', 'clicks', 'unique_clicks', 'cpc', 'ctr', 'impressions', 'reach']
-        insights_params = {
-            'location': {'breakdowns': ['region', 'country'], 'time_range': get_time_range(init_date)},
-            'audience': {'breakdowns': ['age', 'gender'], 'time_range': get_time_range(init_date)}
-        }
-        
-        all_ad_sets, ad_sets_info = [], []
-
-        for campaign in campaigns:
-            ad_sets = list(api_call_with_retries(campaign.get_ad_sets, fields=fields, params=params))
-            for ad_set in ad_sets:
-                ad_set_data = ad_set.export_all_data()
-                if add_insights:
-                    for key, value in insights_params.items():
-                        insights = api_call_with_retries(ad_set.get_insights, fields=insights_fields, params=value)
-                        if insights:
-                            ad_set_data[f'insights_{key}'] = [insight.export_all_data() for insight in insights]
-                ad_sets_info.append(ad_set_data)
-            all_ad_sets.extend(ad_sets)
-
-        return all_ad_sets, ad_sets_info
-
-    def get_ads_with_insights(ad_sets, init_date, add_insights=False):
-        fields = ['id', 'adset_id', 'name', 'status', 'created_time']
-        params = {
-            'time_range': get_time_range(init_date),
-            'level': 'ad'
-        }
-
-        insights_fields = ['spend', 'clicks', 'unique_clicks', 'cpc', 'ctr', 'impressions', 'reach']
-        insights_params = {
-            'location': {'breakdowns': ['region', 'country'], 'time_range': get_time_range(init_date)},
-            'audience': {'breakdowns': ['age', 'gender'], 'time_range': get_time_range(init_date)}
-        }
-
-        ads_info = []
-        for ad_set in ad_sets:
-            ads = list(api_call_with_retries(ad_set.get_ads, fields=fields, params=params))
-            for ad in ads:
-                ad_data = ad.export_all_data()
-                if add_insights:
-                    for key, value in insights_params.items():
-                        insights = api_call_with_retries(ad.get_insights, fields=insights_fields, params=value)
-                        if insights:
-                            ad_data[f'insights_{key}'] = [insight.export_all_data() for insight in insights]
-                ads_info.append(ad_data)
-        
-        return ads_info
-
-    init_date = '2024-01-01'
-    ad_accounts, ad_accounts_info = get_ad_accounts_with_insights(business_id, init_date, add_insights=True)
-
-    for n, ad_account in enumerate(ad_accounts):
-        ad_account_campaigns, ad_account_campaigns_info = get_campaigns_with_insights(ad_account, init_date, effective_status, add_insights=True)
-        ad_account_ad_sets, ad_account_ad_sets_info = get_ad_sets_with_insights(ad_account_campaigns, init_date, add_insights=True)
-        ad_account_ads_info = get_ads_with_insights(ad_account_ad_sets, init_date, add_insights=True)
-
-        for ad_campaign in ad_account_campaigns_info:
-            ad_sets_filtered = list(filter(lambda x: x['campaign_id'] == ad_campaign['id'], ad_account_ad_sets_info))
-            for ad_set in ad_sets_filtered:
-                ads_filtered = list(filter(lambda x: x['adset_id'] == ad_set['id'], ad_account_ads_info))
-                ad_set.update({'ads': ads_filtered})
-            ad_campaign.update({'ad_sets': ad_sets_filtered})
-        ad_accounts_info[n].update({'campaigns': ad_account_campaigns_info})
-
-    return ad_accounts_info
-
-def fetch_data_from_beehiiv_api():
-    api_headers = {
-        "Accept": "application/json",
-        "Authorization": os.environ["BEEHIIV_API_KEY"],
-    }
-    
-    try:
-        # Obtener lista de publicaciones
-        url = "https://api.beehiiv.com/v2/publications"
-        response = requests.get(url, headers=api_headers)
-        response.raise_for_status()
-        publications = response.json()
-        
-        publications_data = {}
-        
-        # Procesar cada publicación
-        for pub in publications['data']:
-            pub_id = pub['id']
-            
-            # Obtener estadísticas de la publicación
-            stats_url = f"{url}/{pub_id}/stats"
-            stats_response = requests.get(stats_url, headers=api_headers)
-            stats_response.raise_for_status()
-            stats = stats_response.json().get('data', {})
-            
-            # Estructurar datos según el esquema de la tabla
-            publications_data[pub_id] = {
-                'publication_id': pub_id,
-                'publication_name': pub['name'],
-                'organization_name': pub['organization_name'],
-                'active_subscriptions': stats.get('active_subscriptions', 0),
-                'active_premium_subscriptions': stats.get('active_premium_subscriptions', 0),
-                'active_free_subscriptions': stats.get('active_free_subscriptions', 0),
-                'average_open_rate': stats.get('average_open_rate', 0.0),
-                'average_click_rate': stats.get('average_click_rate', 0.0),
-                'total_sent': stats.get('total_sent', 0),
-                'total_unique_opened': stats.get('total_unique_opened', 0),
-                'total_clicked': stats.get('total_clicked', 0)
-            }
-            
-            logging.info(f"Processed publication: {pub['name']}")
-            
-        return publications_data
-        
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Beehiiv API Error: {str(e)}")
-        raise
-
-def create_db_rows(beehiiv_info, facebook_info=None):
-    rows = {
-        'newsletter_performance_table': {
-            'columns': "(post_id, publication_id, publication_name, publish_date, delivered, clicks, unique_clicks, click_rate, opens, unique_opens, open_rate, unsubscribes, spam_reports)",
-            'rows': []
-        },
-        'url_performance_table': {
-            'columns': "(post_id, publication_id, url, url_clicks, url_unique_clicks, url_click_through_rate)",
-            'rows': []
-        },
-        'unified_performance_table': {
-            'columns': "(post_id, publication_id, publication_name, publish_date, delivered, clicks, unique_clicks, click_rate, opens, unique_opens, open_rate, unsubscribes, spam_reports, url, url_clicks, url_unique_clicks, url_click_through_rate)",
-            'rows': []
-        },
-        'publications_table': {
-            'columns': "(publication_id, publication_name, organization_name, active_subscriptions, active_premium_subscriptions, active_free_subscriptions, average_open_rate, average_click_rate, total_sent, total_unique_opened, total_clicked)",
-            'rows': []
-        },
-        'segments_table': {
-            'columns': "(publication_id, publication_name, segment_id, segment_name, segment_type, last_calculated, total_results, segment_status)",
-            'rows': []
-        },
-        'ad_account_table': {
-            'columns': "(account_id, name, status, currency, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, objective, created_time, updated_time)",
-            'rows': []
-        },
-        'campaign_table': {
-            'columns': "(campaign_id, ad_account_id, name, status, objective, budget, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
-            'rows': []
-        },
-        'ad_set_audience_table': {
-            'columns': "(ad_set_id, campaign_id, name, status, objective, bid_amount, bid_strategy, billing_event, budget_remaining, age_targeting, geo_targeting, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
-            'rows': []
-        },
-        'ad_set_location_table': {
-            'columns': "(ad_set_id, campaign_id, name, status, objective, bid_amount, bid_strategy, billing_event, budget_remaining, age_targeting, geo_targeting, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
-            'rows': []
-        },
-        'ad_audience_table': {
-            'columns': "(ad_id, ad_set_id, name, status, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
-            'rows': []
-        },
-        'ad_location_table': {
-            'columns': "(ad_id, ad_set_id, name, status, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
-            'rows': []
-        }
-    }
-
-    for nls in beehiiv_info.values():
-        rows['publications_table']['rows'].append((
-            nls['id'], 
-            nls['name'], 
-            nls['organization_name'],
-            nls['active_subscriptions'], 
-            nls['active_premium_subscriptions'],
-            nls['active_free_subscriptions'], 
-            nls['average_open_rate'],
-            nls['average_click_rate'], 
-            nls['total_sent'],
-            nls['total_unique_opened'], 
-            nls['total_clicked']
-        ))
-
-        if 'publication_segments' in nls:
-            for segment in nls['publication_segments']:
-                rows['segments_table']['rows'].append((
-                    segment['publication_id'],
-                    segment['publication_name'],
-                    segment['segment_id'],
-                    segment['segment_name'],
-                    segment['segment_type'],
-                    segment['last_calculated'],
-                    segment['total_results'],
-                    segment['status']
-                ))
-
-        if 'publication_posts' in nls:
-            for post in nls['publication_posts']:
-                rows['newsletter_performance_table']['rows'].append((
-                    post['post_id'],
-                    post['publication_id'],
-                    post['publication_name'],
-                    post['publish_date'],
-                    post['delivered'],
-                    post['clicks'],
-                    post['unique_clicks'],
-                    post['click_rate'],
-                    post['opens'],
-                    post['unique_opens'],
-                    post['open_rate'],
-                    post['unsubscribes'],
-                    post['spam_reports']
-                ))
-
-                for url in post['urls'].values():
-                    rows['url_performance_table']['rows'].append((
-                        url['post_id'],
-                        url['publication_id'],
-                        url['url'],
-                        url['url_clicks'],
-                        url['url_unique_clicks'],
-                        url['url_click_through_rate']
-                    ))
-
-                    rows['unified_performance_table']['rows'].append((
-                        post['post_id'],
-                        post['publication_id'],
-                        post['publication_name'],
-                        post['publish_date'],
-                        post['delivered'],
-                        post['clicks'],
-                        post['unique_clicks'],
-                        post['click_rate'],
-                        post['opens'],
-                        post['unique_opens'],
-                        post['open_rate'],
-                        post['unsubscribes'],
-                        post['spam_reports'],
-                        url['url'],
-                        url['url_clicks'],
-                        url['url_unique_clicks'],
-                        url['url_click_through_rate']
-                    ))
-
-    for ad_account in facebook_info:
-        rows['ad_account_table']['rows'].append((
-            ad_account['id'],
-            ad_account['name'],
-            'ACTIVE',
-            ad_account['currency'],
-            sum(insight['spend'] for insight in ad_account['insights_location']) if 'insights_location' in ad_account else 0,
-            sum(insight['clicks'] for insight in ad_account['insights_location']) if 'insights_location' in ad_account else 0,
-            sum(insight['unique_clicks'] for insight in ad_account['insights_location']) if 'insights_location' in ad_account else 0,
-            sum(insight['impressions'] for insight in ad_account['insights_location']) if 'insights_location' in ad_account else 0,
-            sum(insight['reach'] for insight in ad_account['insights_location']) if 'insights_location' in ad_account else 0,
-            sum(insight['cpc'] for insight in ad_account['insights_location']) / len(ad_account['insights_location']) if 'insights_location' in ad_account and ad_account['insights_location'] else 0,
-            sum(insight['ctr'] for insight in ad_account['insights_location']) / len(ad_account['insights_location']) if 'insights_location' in ad_account and ad_account['insights_location'] else 0,
-            None,
-            ad_account['created_time'],
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-
-        if 'campaigns' in ad_account:
-            for campaign in ad_account['campaigns']:
-                rows['campaign_table']['rows'].append((
-                    campaign['id'],
-                    ad_account['id'],
-                    campaign['name'],
-                    campaign['status'],
-                    campaign['objective'],
-                    float(campaign['daily_budget']) if 'daily_budget' in campaign else float(campaign['lifetime_budget']) if 'lifetime_budget' in campaign else 0,
-                    sum(insight['spend'] for insight in campaign['insights_location']) if 'insights_location' in campaign else 0,
-                    sum(insight['clicks'] for insight in campaign['insights_location']) if 'insights_location' in campaign else 0,
-                    sum(insight['unique_clicks'] for insight in campaign['insights_location']) if 'insights_location' in campaign else 0,
-                    sum(insight['impressions'] for insight in campaign['insights_location']) if 'insights_location' in campaign else 0,
-                    sum(insight['reach'] for insight in campaign['insights_location']) if 'insights_location' in campaign else 0,
-                    sum(insight['cpc'] for insight in campaign['insights_location']) / len(campaign['insights_location']) if 'insights_location' in campaign and campaign['insights_location'] else 0,
-                    sum(insight['ctr'] for insight in campaign['insights_location']) / len(campaign['insights_location']) if 'insights_location' in campaign and campaign['insights_location'] else 0,
-                    campaign['created_time'],
-                    campaign['start_time'],
-                    campaign['stop_time'],
-                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                ))
-
-                if 'ad_sets' in campaign:
-                    for ad_set in campaign['ad_sets']:
-                        if 'insights_audience' in ad_set:
-                            for insight in ad_set['insights_audience']:
-                                rows['ad_set_audience_table']['rows'].append((
-                                    ad_set['id'],
-                                    campaign['id'],
-                                    ad_set['name'],
-                                    ad_set['status'],
-                                    campaign['objective'],
-                                    float(ad_set['bid_amount']) if 'bid_amount' in ad_set else 0,
-                                    ad_set['bid_strategy'] if 'bid_strategy' in ad_set else None,
-                                    ad_set['billing_event'] if 'billing_event' in ad_set else None,
-                                    float(ad_set['daily_budget']) if 'daily_budget' in ad_set else float(ad_set['lifetime_budget']) if 'lifetime_budget' in ad_set else 0,
-                                    ad_set['targeting']['age_min'] if 'targeting' in ad_set and 'age_min' in ad_set['targeting'] else None,
-                                    json.dumps(ad_set['targeting']['geo_locations']) if 'targeting' in ad_set and 'geo_locations' in ad_set['targeting'] else None,
-                                    insight['age'],
-                                    insight['gender'],
-                                    insight['spend'],
-                                    insight['clicks'],
-                                    insight['unique_clicks'],
-                                    insight['impressions'],
-                                    insight['reach'],
-                                    insight['cpc'],
-                                    insight['ctr'],
-                                    ad_set['created_time'],
-                                    ad_set['start_time'],
-                                    ad_set['stop_time'],
-                                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                ))
-
-                        if 'insights_location' in ad_set:
-                            for insight in ad_set['insights_location']:
-                                rows['ad_set_location_table']['rows'].append((
-                                    ad_set['id'],
-                                    campaign['id'],
-                                    ad_set['name'],
-                                    ad_set['status'],
-                                    campaign['objective'],
-                                    float(ad_set['bid_amount']) if 'bid_amount' in ad_set else 0,
-                                    ad_set['bid_strategy'] if 'bid_strategy' in ad_set else None,
-                                    ad_set['billing_event'] if 'billing_event' in ad_set else None,
-                                    float(ad_set['daily_budget']) if 'daily_budget' in ad_set else float(ad_set['lifetime_budget']) if 'lifetime_budget' in ad_set else 0,
-                                    ad_set['targeting']['age_min'] if 'targeting' in ad_set and 'age_min' in ad_set['targeting'] else None,
-                                    json.dumps(ad_set['targeting']['geo_locations']) if 'targeting' in ad_set and 'geo_locations' in ad_set['targeting'] else None,
-                                    insight['region'],
-                                    insight['country'],
-                                    insight['spend'],
-                                    insight['clicks'],
-                                    insight['unique_clicks'],
-                                    insight['impressions'],
-                                    insight['reach'],
-                                    insight['cpc'],
-                                    insight['ctr'],
-                                    ad_set['created_time'],
-                                    ad_set['start_time'],
-                                    ad_set['stop_time'],
-                                    datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                ))
-
-                        if 'ads' in ad_set:
-                            for ad in ad_set['ads']:
-                                if 'insights_audience' in ad:
-                                    for insight in ad['insights_audience']:
-                                        rows['ad_audience_table']['rows'].append((
-                                            ad['id'],
-                                            ad_set['id'],
-                                            ad['name'],
-                                            ad['status'],
-                                            insight['age'],
-                                            insight['gender'],
-                                            insight['spend'],
-                                            insight['clicks'],
-                                            insight['unique_clicks'],
-                                            insight['impressions'],
-                                            insight['reach'],
-                                            insight['cpc'],
-                                            insight['ctr'],
-                                            ad['created_time'],
-                                            None,
-                                            None,
-                                            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                        ))
-
-                                if 'insights_location' in ad:
-                                    for insight in ad['insights_location']:
-                                        rows['ad_location_table']['rows'].append((
-                                            ad['id'],
-                                            ad_set['id'],
-                                            ad['name'],
-                                            ad['status'],
-                                            insight['region'],
-                                            insight['country'],
-                                            insight['spend'],
-                                            insight['clicks'],
-                                            insight['unique_clicks'],
-                                            insight['impressions'],
-                                            insight['reach'],
-                                            insight['cpc'],
-                                            insight['ctr'],
-                                            ad['created_time'],
-                                            None,
-                                            None,
-                                            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                        ))
-
-    return rows
-
-def insert_db_data(connection, cursor, rows):
-    try:
-        for table_name, table_data in rows.items():
-            # Limpiar tabla existente
-            cursor.execute(f"TRUNCATE TABLE {table_name} CASCADE;")
-            
-            # Insertar nuevos datos
-            if table_data['rows']:
-                args_str = ','.join(cursor.mogrify("(" + ",".join(["%s"] * len(row)) + ")", row).decode('utf-8') 
-                                  for row in table_data['rows'])
-                cursor.execute(f"""
-                    INSERT INTO {table_name} {table_data['columns']}
-                    VALUES {args_str}
-                """)
-        
-        connection.commit()
-        logging.info("Datos insertados exitosamente")
-        
-    except Exception as e:
-        connection.rollback()
-        logging.error(f"Error insertando datos: {str(e)}")
-        raise
-    finally:
-        cursor.close()
-        connection.close()
\ No newline at end of file
+import importlib
+
+# Punto de entrada de la sincronización. El código vive en sync/ (metrics, http_client, cache,
+# rows, beehiiv, facebook, db, fanout) y cada nombre se importa desde su módulo recién la primera
+# vez que se usa: la sincronización de Beehiiv no carga facebook_business, y la de Facebook no
+# carga nada de Beehiiv. Lo que tarda cada import queda en el reporte de la corrida (imports): el
+# tiempo es acumulado por punto de entrada, e incluye los módulos de sync/ y las dependencias que ese
+# módulo importó por primera vez (facebook incluye http_client, cache y facebook_business si aún no
+# estaban cargados); un módulo que ya trajo otro no vuelve a aparecer.
+_EXPORTS = {
+    'metrics': (
+        'RunMetrics', 'run_metrics', 'ContextThreadPoolExecutor', 'reset_run_metrics', 'emit_run_report', 'timed_stage'
+    ),
+    'http_client': (
+        'HTTP_TIMEOUT', 'HTTP_MAX_RETRIES', 'HTTP_BACKOFF_FACTOR', 'HTTP_MAX_RETRY_WAIT',
+        'HTTP_RETRY_STATUSES', 'parse_usage_headers', 'usage_wait_seconds', 'UsageAwareRetry',
+        'configure_http_session', 'create_http_session', 'record_http_response', 'bounded_map'
+    ),
+    'cache': (
+        'RESPONSE_CACHE_TTLS', 'DEFAULT_RESPONSE_CACHE_MAX_MB', 'ResponseCache', 'get_response_cache'
+    ),
+    'rows': (
+        'DAILY_INSIGHTS_LEVELS', 'DEFAULT_SYNC_MODE', 'index_ad_account', 'index_facebook_info',
+        'INSIGHT_METRICS', 'INSIGHT_BREAKDOWN_COLUMNS', 'INSIGHT_COUNT_METRICS', 'InsightRecord', 'parse_insight',
+        'summarize_insights', 'INSIGHT_ROLLUP_COLUMNS', 'INSIGHT_ROLLUPS', 'rollup_ad_account_ids',
+        'create_db_rows', 'create_beehiiv_rows', 'create_facebook_rows', 'apply_sync_modes',
+        'UNIT_SCOPES', 'scope_unit_rows', 'iter_db_row_units'
+    ),
+    'beehiiv': (
+        'BEEHIIV_API_URL', 'BEEHIIV_PAGE_SIZE', 'DEFAULT_BEEHIIV_MAX_WORKERS', 'fetch_data_from_beehiiv_api'
+    ),
+    'facebook': (
+        'DEFAULT_FACEBOOK_MAX_ACCOUNTS', 'DEFAULT_FACEBOOK_ACCOUNT_WORKERS', 'DEFAULT_FACEBOOK_INSIGHTS_MODE',
+        'FACEBOOK_GRAPH_URL', 'FACEBOOK_GRAPH_VERSION', 'GRAPH_BATCH_SIZE', 'DEFAULT_FACEBOOK_STRUCTURE_MODE',
+        'EXPAND_PAGE_SIZE', 'EXPAND_NESTED_PAGE_SIZE', 'GRAPH_DATA_TOO_LARGE_ERROR_CODE', 'GRAPH_BATCH_EDGES',
+        'LEVEL_INSIGHTS_PAGE_SIZE', 'DEFAULT_FACEBOOK_INSIGHTS_WINDOW', 'DEFAULT_FACEBOOK_LOOKBACK_DAYS',
+        'ASYNC_REPORT_POLL_INTERVAL', 'ASYNC_REPORT_MAX_POLL_INTERVAL', 'LEVEL_ID_FIELDS',
+        'RATE_LIMIT_ERROR_CODES', 'RATE_LIMIT_SLOWDOWN_USAGE', 'RATE_LIMIT_MAX_INTERVAL',
+        'RATE_LIMIT_FALLBACK_WAIT', 'RATE_LIMIT_MAX_WAIT', 'RateLimitScheduler', 'UsageLimiter',
+        'group_by_parent', 'fetch_data_from_facebook_api'
+    ),
+    'db': (
+        'db_connection_params', 'create_db_connection', 'create_db_pool', 'DEFAULT_LOAD_METHOD',
+        'DEFAULT_BATCH_SIZE', 'VOLATILE_COLUMNS', 'CopyRowStream', 'copy_rows', 'execute_values_rows',
+        'LOAD_METHODS', 'write_table_rows', 'SYNC_TABLES_DDL', 'ensure_sync_tables', 'get_sync_watermarks',
+        'replace_table_rows', 'upsert_table_rows', 'create_seen_table', 'delete_missing_rows',
+        'get_foreign_keys', 'get_table_indexes', 'create_staging_table', 'build_staging_indexes',
+        'swap_staging_tables', 'validate_foreign_keys', 'swap_table_rows', 'refresh_rollups', 'SYNC_MODES', 'prepare_db_tables',
+        'SYNC_RESUME_MAX_AGE_HOURS', 'start_sync_run', 'get_completed_units', 'record_checkpoint', 'get_run_tables', 'record_run_table',
+        'finish_sync_run', 'stream_db_data', 'insert_db_data', 'DEFAULT_DB_MAX_CONNECTIONS',
+        'group_related_tables', 'load_table_group', 'parallel_insert_db_data'
+    ),
+    'fanout': (
+        'SYNC_SOURCES', 'DEFAULT_SYNC_SOURCES', 'get_sync_sources', 'list_sync_units', 'create_work_items', 'sync_unit'
+    )
+}
+_MODULE_BY_NAME = {name: module for module, names in _EXPORTS.items() for name in names}
+_LOADED = set()
+
+def _load(module):
+    # Dentro de la función de Azure este archivo es parte de un paquete; en los benchmarks se
+    # importa como módulo suelto desde la raíz del repo
+    module_name = f'{__package__}.sync.{module}' if __package__ else f'sync.{module}'
+    if module_name in _LOADED:
+        return sys.modules[module_name]
+    # import_module espera si otro hilo está importando el mismo módulo; sys.modules ya lo tendría
+    # a medio inicializar. Solo el hilo que lo importó de verdad registra el tiempo.
+    already_imported = module_name in sys.modules
+    started = time.perf_counter()
+    loaded = importlib.import_module(module_name)
+    if not already_imported:
+        _load('metrics').run_metrics.record_import(module, time.perf_counter() - started)
+    _LOADED.add(module_name)
+    return loaded
+
+def __getattr__(name):
+    if name not in _MODULE_BY_NAME:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Sin cachear en este módulo: run_metrics cambia en cada reset_run_metrics
+    return getattr(_load(_MODULE_BY_NAME[name]), name)
+
+def __dir__():
+    return sorted(list(globals()) + list(_MODULE_BY_NAME))
\ No newline at end of file
@@ -0,0 +1,70 @@
+import time
+
+from benchmarks.fake_http import FakeAPIHandler, SlidingWindowQuota, create_handler, start_server
+
+# Servidor falso de la API v2 de Beehiiv: publicaciones y segmentos paginados por página,
+# posts por cursor, estadísticas de la publicación y de cada post (expand[]=stats).
+# Con calls_per_window > 0 responde 429 con Retry-After al superar la cuota.
+DEFAULT_LATENCY = 0.02
+DEFAULT_QUOTA_WINDOW = 1.0
+
+class BeehiivHandler(FakeAPIHandler):
+    dataset = None
+    quota = None
+
+    def do_GET(self):
+        parts, params = self.read_params()
+        if self.handle_stats(parts):
+            return
+        time.sleep(self.latency)
+        self.count('requests')
+
+        _, retry_after = self.quota.hit('api')
+        if retry_after:
+            self.count('throttled')
+            self.send_json(429, {'errors': [{'message': 'Too many requests'}]}, {'Retry-After': str(max(1, round(retry_after)))})
+            return
+
+        # /v2/publications[/<id>[/stats|/segments|/posts[/<post_id>]]]
+        parts = parts[1:]
+        body = None
+        if parts == ['publications']:
+            self.count('publications')
+            body = self.page(self.dataset.publications(), params)
+        elif len(parts) == 3 and parts[2] == 'stats':
+            self.count('stats')
+            body = {'data': self.dataset.publication_stats(parts[1])}
+        elif len(parts) == 3 and parts[2] == 'segments':
+            self.count('segments')
+            body = self.page(self.dataset.segments(parts[1]), params)
+        elif len(parts) == 3 and parts[2] == 'posts':
+            self.count('posts')
+            body = self.cursor_page(self.dataset.posts(parts[1]), params)
+        elif len(parts) == 4 and parts[2] == 'posts':
+            self.count('post')
+            body = {'data': self.dataset.post(parts[1], parts[3])}
+
+        if body is None:
+            self.send_json(404, {'errors': [{'message': 'Not found'}]})
+            return
+        self.send_json(200, body)
+
+    def page(self, items, params):
+        limit = int(params.get('limit', 10))
+        page = int(params.get('page', 1))
+        return {'data': items[(page - 1) * limit:page * limit], 'page': page, 'limit': limit, 'total_pages': -(-len(items) // limit)}
+
+    def cursor_page(self, items, params):
+        limit = int(params.get('limit', 10))
+        start = int(params.get('cursor', 0))
+        has_more = start + limit < len(items)
+        return {'data': items[start:start + limit], 'has_more': has_more, 'next_cursor': str(start + limit) if has_more else None}
+
+def create_beehiiv_server(dataset, port=0, latency=DEFAULT_LATENCY, calls_per_window=0, window=DEFAULT_QUOTA_WINDOW):
+    handler = create_handler(
+        BeehiivHandler,
+        dataset=dataset,
+        latency=latency,
+        quota=SlidingWindowQuota(calls_per_window, window)
+    )
+    return start_server(handler, port=port)
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from benchmarks.fake_http import FakeAPIHandler, SlidingWindowQuota, create_handler, start_server
+
+# Servidor falso de la Graph API: paginación por cursor (after), insights con desgloses por
+# objeto o por nivel (level=campaign|adset|ad), reportes asíncronos (AdReportRun) y los
+# encabezados de uso x-business-use-case-usage, x-ad-account-usage y x-fb-ads-insights-throttle.
+# Acepta batch requests (POST con batch=[...]) y expansión de campos anidados
+# (fields=id,adsets.limit(50){id,ads{id}}) como la API real. Con max_objects > 0 una respuesta con
+# más objetos responde el error 1 ("Please reduce the amount of data...") con estado 500.
+# Con calls_per_window > 0 cada cuenta tiene una cuota; al superarla responde con el error 80004
+# (gestión de anuncios) o 17 (insights) y el tiempo de recuperación en los encabezados.
+DEFAULT_LATENCY = 0.02
+DEFAULT_PAGE_SIZE = 25
+DEFAULT_QUOTA_WINDOW = 1.0
+DEFAULT_REPORT_POLLS = 1
+IDLE_USAGE = 5
+NESTED_PAGE_SIZE = 25
+
+def parse_fields(spec):
+    # 'id,name,adsets.limit(50){id,ads{id}}' -> [('id', None, None), ..., ('adsets', 50, [('id', None, None), ('ads', None, [...])])]
+    fields, depth, start = [], 0, 0
+    for position, char in enumerate(spec + ','):
+        if char in '{(':
+            depth += 1
+        elif char in '})':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            field = spec[start:position].strip()
+            start = position + 1
+            if not field:
+                continue
+            subfields = None
+            if field.endswith('}'):
+                field, subfields = field[:-1].split('{', 1)
+                subfields = parse_fields(subfields)
+            name, _, modifiers = field.partition('.')
+            limit = int(modifiers[len('limit('):-1]) if modifiers.startswith('limit(') else None
+            fields.append((name, limit, subfields))
+    return fields
+
+def object_account(node):
+    # Cuenta a la que pertenece un nodo: act_<n>, c<n>_..., s<n>_..., d<n>_...
+    if node.startswith('act_'):
+        return node[4:]
+    if node[:1] in ('c', 's', 'd') and '_' in node:
+        return node[1:].split('_', 1)[0]
+    return None
+
+class GraphHandler(FakeAPIHandler):
+    dataset = None
+    page_size = DEFAULT_PAGE_SIZE
+    report_polls = DEFAULT_REPORT_POLLS
+    quota = None
+    reports = None
+    reports_lock = None
+    max_objects = 0
+
+    def do_GET(self):
+        self.handle_call()
+
+    def do_POST(self):
+        self.handle_call()
+
+    def handle_call(self):
+        parts, params = self.read_params()
+        if self.handle_stats(parts):
+            return
+        time.sleep(self.latency)
+        self.count('requests')
+
+        if self.command == 'POST' and len(parts) == 1 and 'batch' in params:
+            # Batch request: cada llamada se resuelve como si llegara sola, con su código,
+            # encabezados y cuerpo, y se cuenta contra la cuota de su cuenta
+            self.count('batch')
+            responses = []
+            for call in params['batch']:
+                self.count('batch_calls')
+                url = urlparse(call['relative_url'])
+                call_params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                call_params = {key: json.loads(value) if value[:1] in ('[', '{') else value for key, value in call_params.items()}
+                status, body, headers = self.respond(call.get('method', 'GET'), ['batch'] + [part for part in url.path.split('/') if part], call_params)
+                responses.append({'code': status, 'headers': [{'name': name, 'value': value} for name, value in headers.items()], 'body': json.dumps(body)})
+            self.send_json(200, responses)
+            return
+
+        self.send_json(*self.respond(self.command, parts, params))
+
+    def respond(self, method, parts, params):
+        # /<versión>/<nodo>[/<edge>]
+        node = parts[1] if len(parts) > 1 else ''
+        edge = parts[2] if len(parts) > 2 else None
+        with self.reports_lock:
+            report = self.reports.get(node)
+        account = report['account'] if report else object_account(node)
+        insights = edge == 'insights' or report is not None
+        self.count(f"{method} {edge or ('report' if report else 'node')}")
+
+        headers, throttled = self.usage_headers(account, insights)
+        if throttled:
+            self.count('throttled')
+            code, message = (17, 'User request limit reached') if insights else (80004, 'There have been too many calls to this ad-account.')
+            return 400, {'error': {'message': message, 'type': 'OAuthException', 'code': code, 'is_transient': True, 'fbtrace_id': 'benchmark'}}, headers
+
+        if method == 'POST' and edge == 'insights':
+            with self.reports_lock:
+                report_id = f'report_{len(self.reports)}'
+                self.reports[report_id] = {'account': account, 'node': node, 'params': params, 'polls': 0}
+            return 200, {'report_run_id': report_id}, headers
+
+        if report and edge is None:
+            with self.reports_lock:
+                report['polls'] += 1
+                done = report['polls'] >= self.report_polls
+            return 200, {
+                'id': node,
+                'async_status': 'Job Completed' if done else 'Job Running',
+                'async_percent_completion': 100 if done else 50
+            }, headers
+
+        items = self.list_edge(node, edge, params, report)
+        if items is None:
+            return 200, {'id': node}, headers
+        body = self.page(items, params)
+        nested = [field for field in parse_fields(params.get('fields') or '') if field[2] is not None]
+        if nested and not report:
+            objects = len(body['data']) + sum(self.expand(item, nested) for item in body['data'])
+            if self.max_objects and objects > self.max_objects:
+                self.count('too_large')
+                return 500, {'error': {'message': "Please reduce the amount of data you're asking for, then retry your request", 'type': 'OAuthException', 'code': 1, 'fbtrace_id': 'benchmark'}}, headers
+        return 200, body, headers
+
+    def expand(self, item, nested):
+        # Agrega a un objeto las primeras páginas de sus edges anidados; devuelve cuántos objetos agregó
+        added = 0
+        for name, limit, subfields in nested:
+            children = self.list_edge(item['id'], name, {})
+            if children is None:
+                continue
+            limit = limit or NESTED_PAGE_SIZE
+            page = {'data': [dict(child) for child in children[:limit]], 'paging': {'cursors': {'before': '0', 'after': str(limit)}}}
+            if limit < len(children):
+                page['paging']['next'] = f'http://{self.headers.get("Host")}/next?after={limit}'
+            item[name] = page
+            added += len(page['data'])
+            children_nested = [field for field in subfields if field[2] is not None]
+            if children_nested:
+                added += sum(self.expand(child, children_nested) for child in page['data'])
+        return added
+
+    def list_edge(self, node, edge, params, report=None):
+        if report:
+            return self.dataset.insights(report['node'], report['params'])
+        if edge == 'owned_ad_accounts':
+            return self.dataset.ad_accounts()
+        if edge == 'campaigns':
+            return self.dataset.campaigns(node)
+        if edge == 'adsets':
+            return self.dataset.ad_sets(node)
+        if edge == 'ads':
+            return self.dataset.ads(node)
+        if edge == 'insights':
+            return self.dataset.insights(node, params)
+        return None
+
+    def page(self, items, params):
+        limit = int(params.get('limit') or self.page_size)
+        after = int(params.get('after') or 0)
+        body = {'data': items[after:after + limit], 'paging': {'cursors': {'before': str(after), 'after': str(after + limit)}}}
+        if after + limit < len(items):
+            body['paging']['next'] = f'http://{self.headers.get("Host")}/next?after={after + limit}'
+        return body
+
+    def usage_headers(self, account, insights):
+        business_usage, _ = self.quota.hit('business', self.quota.calls_per_window * self.dataset.accounts)
+        account_usage, regain = self.quota.hit(f'account:{account}') if account is not None else (0, 0)
+        if not self.quota.calls_per_window:
+            business_usage = account_usage = IDLE_USAGE
+        headers = {
+            'x-business-use-case-usage': json.dumps({self.dataset.business_id: [{
+                'type': 'ads_insights' if insights else 'ads_management',
+                'call_count': round(business_usage),
+                'total_cputime': round(business_usage / 2),
+                'total_time': round(business_usage / 2),
+                'estimated_time_to_regain_access': 0
+            }]})
+        }
+        if account is not None:
+            headers['x-ad-account-usage'] = json.dumps({'acc_id_util_pct': round(account_usage, 2), 'reset_time_duration': round(regain, 3)})
+            if insights:
+                headers['x-fb-ads-insights-throttle'] = json.dumps({'app_id_util_pct': round(business_usage, 2), 'acc_id_util_pct': round(account_usage, 2)})
+        return headers, regain > 0
+
+def create_graph_server(dataset, port=0, latency=DEFAULT_LATENCY, page_size=DEFAULT_PAGE_SIZE, calls_per_window=0,
+                        window=DEFAULT_QUOTA_WINDOW, report_polls=DEFAULT_REPORT_POLLS, max_objects=0):
+    handler = create_handler(
+        GraphHandler,
+        dataset=dataset,
+        latency=latency,
+        page_size=page_size,
+        report_polls=report_polls,
+        max_objects=max_objects,
+        quota=SlidingWindowQuota(calls_per_window, window),
+        reports={},
+        reports_lock=threading.Lock()
+    )
+    return start_server(handler, port=port)
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class SlidingWindowQuota:
+    # Cuota de llamadas por ámbito en una ventana deslizante de `window` segundos.
+    # Con calls_per_window=0 no hay límite.
+    def __init__(self, calls_per_window=0, window=1.0):
+        self.calls_per_window = calls_per_window
+        self.window = window
+        self._calls = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def hit(self, scope, capacity=None):
+        # Registra una llamada y devuelve (uso en %, segundos hasta que se libera la ventana).
+        # Una llamada por encima del 100% no se registra: es la que el servidor rechaza.
+        capacity = capacity or self.calls_per_window
+        if not capacity:
+            return 0, 0
+        with self._lock:
+            now = time.monotonic()
+            calls = self._calls[scope]
+            while calls and calls[0] <= now - self.window:
+                calls.popleft()
+            if len(calls) >= capacity:
+                return 100, calls[0] + self.window - now
+            calls.append(now)
+            return len(calls) * 100 / capacity, 0
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que el cliente pueda reutilizar las conexiones como contra la API real
+    protocol_version = 'HTTP/1.1'
+    latency = 0
+    stats = None
+    stats_lock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, name):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def read_params(self):
+        # Parámetros de la query o del formulario; listas y objetos vienen como JSON
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length', 0))
+            params.update(parse_qs(self.rfile.read(length).decode()))
+        decoded = {}
+        for key, values in params.items():
+            value = values[0]
+            if value[:1] in ('[', '{'):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            decoded[key] = value
+        return [part for part in url.path.split('/') if part], decoded
+
+    def send_json(self, status, body, headers=None):
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def handle_stats(self, parts):
+        # GET /__stats devuelve los contadores del servidor (para el informe del benchmark)
+        if parts == ['__stats']:
+            with self.stats_lock:
+                self.send_json(200, dict(self.stats))
+            return True
+        return False
+
+def create_handler(base_class, **attributes):
+    # Cada servidor tiene su propia clase de handler con su dataset, latencia y contadores
+    attributes.setdefault('stats', {})
+    attributes.setdefault('stats_lock', threading.Lock())
+    return type(base_class.__name__, (base_class,), attributes)
+
+def start_server(handler_class, host='127.0.0.1', port=0):
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import tracemalloc
+from datetime import datetime
+from decimal import Decimal
+
+import requests
+
+from benchmarks.fake_beehiiv import create_beehiiv_server
+from benchmarks.fake_graph import create_graph_server
+from benchmarks.synthetic import SyntheticDataset
+
+# Benchmark sin conexión: levanta los servidores falsos de la Graph API y de Beehiiv en otro
+# proceso (para que no cuenten en el tiempo ni en la memoria), apunta el módulo a ellos con
+# FACEBOOK_GRAPH_URL / BEEHIIV_API_URL y mide cada fase con tiempo y pico de memoria (tracemalloc).
+# La carga en Postgres usa las variables DB_* de siempre, en un esquema aparte que se recrea.
+DEFAULT_DB_SCHEMA = 'benchmark'
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='Benchmark offline de la sincronización Facebook / Beehiiv')
+    dataset = parser.add_argument_group('dataset sintético')
+    dataset.add_argument('--accounts', type=int, default=3)
+    dataset.add_argument('--campaigns', type=int, default=5, help='campañas por cuenta')
+    dataset.add_argument('--ad-sets', type=int, default=4, help='ad sets por campaña')
+    dataset.add_argument('--ads', type=int, default=3, help='ads por ad set')
+    dataset.add_argument('--regions', type=int, default=5, help='filas del desglose por región')
+    dataset.add_argument('--age-buckets', type=int, default=4, help='rangos de edad del desglose por audiencia')
+    dataset.add_argument('--genders', type=int, default=2, help='géneros del desglose por audiencia')
+    dataset.add_argument('--days', type=int, default=7, help='días de insights diarios (FACEBOOK_INSIGHTS_WINDOW=daily)')
+    dataset.add_argument('--publications', type=int, default=3)
+    dataset.add_argument('--posts', type=int, default=20, help='posts por publicación')
+    dataset.add_argument('--segments', type=int, default=3, help='segmentos por publicación')
+    dataset.add_argument('--urls', type=int, default=3, help='URLs por post')
+
+    servers = parser.add_argument_group('servidores falsos')
+    servers.add_argument('--latency', type=float, default=0.02, help='segundos por llamada')
+    servers.add_argument('--page-size', type=int, default=25, help='tamaño de página por defecto de la Graph API')
+    servers.add_argument('--graph-quota', type=int, default=0, help='llamadas por cuenta y ventana antes de responder 17/80004 (0 = sin límite)')
+    servers.add_argument('--beehiiv-quota', type=int, default=0, help='llamadas por ventana antes de responder 429 (0 = sin límite)')
+    servers.add_argument('--max-objects', type=int, default=0, help='objetos por respuesta con campos anidados antes de responder el error 1 (0 = sin límite)')
+    servers.add_argument('--quota-window', type=float, default=1.0, help='segundos de la ventana de cuota')
+    servers.add_argument('--serve-only', action='store_true', help='solo levantar los servidores e imprimir las variables de entorno')
+
+    run = parser.add_argument_group('corrida')
+    run.add_argument('--skip-facebook', action='store_true')
+    run.add_argument('--skip-beehiiv', action='store_true')
+    run.add_argument('--batch-requests', action='store_true', help='FACEBOOK_BATCH_REQUESTS=true')
+    run.add_argument('--structure-mode', choices=['edges', 'expand'], default=None, help='FACEBOOK_STRUCTURE_MODE')
+    run.add_argument('--rollups', action='store_true', help='INSIGHT_ROLLUPS=true (métricas de cuentas y campañas calculadas en la base)')
+    run.add_argument('--insights-mode', choices=['object', 'level', 'async'], default=None, help='FACEBOOK_INSIGHTS_MODE')
+    run.add_argument('--sync-mode', choices=['replace', 'upsert', 'swap'], default=None, help='DB_SYNC_MODE')
+    run.add_argument('--load-method', default=None, help='DB_LOAD_METHOD')
+    run.add_argument('--batch-size', type=int, default=None, help='DB_BATCH_SIZE')
+    run.add_argument('--db', action='store_true', help='cargar en Postgres (variables DB_*)')
+    run.add_argument('--db-schema', default=DEFAULT_DB_SCHEMA, help='esquema que se borra y recrea para la carga')
+    run.add_argument('--parallel', action='store_true', help='usar parallel_insert_db_data en lugar de insert_db_data')
+    run.add_argument('--fanout', type=int, default=0, metavar='N', help='después de la carga, volver a sincronizar cada unidad desde una cola en el proceso con N workers (sync_unit)')
+    run.add_argument('--stream', action='store_true', help='descargar y cargar en streaming (stream_db_data) en una sola fase')
+    run.add_argument('--no-memory', action='store_true', help='no medir memoria (tracemalloc agrega overhead)')
+    run.add_argument('--json', dest='json_path', help='escribir el informe completo en este archivo')
+    run.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+def dataset_options(args):
+    return {
+        'accounts': args.accounts,
+        'campaigns': args.campaigns,
+        'ad_sets': args.ad_sets,
+        'ads': args.ads,
+        'regions': args.regions,
+        'age_buckets': args.age_buckets,
+        'genders': args.genders,
+        'days': args.days,
+        'publications': args.publications,
+        'posts': args.posts,
+        'segments': args.segments,
+        'urls_per_post': args.urls
+    }
+
+def serve(options, graph_options, beehiiv_options, ports):
+    dataset = SyntheticDataset(**options)
+    graph = create_graph_server(dataset, **graph_options)
+    beehiiv = create_beehiiv_server(dataset, **beehiiv_options)
+    ports.put((graph.server_address[1], beehiiv.server_address[1]))
+    while True:
+        time.sleep(3600)
+
+def start_servers(args):
+    graph_options = {'latency': args.latency, 'page_size': args.page_size, 'calls_per_window': args.graph_quota, 'window': args.quota_window,
+                     'max_objects': args.max_objects}
+    beehiiv_options = {'latency': args.latency, 'calls_per_window': args.beehiiv_quota, 'window': args.quota_window}
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(dataset_options(args), graph_options, beehiiv_options, ports), daemon=True)
+    process.start()
+    graph_port, beehiiv_port = ports.get(timeout=30)
+    return process, f'http://127.0.0.1:{graph_port}', f'http://127.0.0.1:{beehiiv_port}'
+
+def configure_environment(args, graph_url, beehiiv_url):
+    # Credenciales ficticias: nunca se usan las reales contra los servidores falsos
+    os.environ.update({
+        'FACEBOOK_GRAPH_URL': graph_url,
+        'FACEBOOK_APP_ID': 'benchmark',
+        'FACEBOOK_APP_SECRET': 'benchmark',
+        'FACEBOOK_ACCESS_TOKEN': 'benchmark',
+        'FACEBOOK_BUSINESS_ID': SyntheticDataset().business_id,
+        'BEEHIIV_API_URL': f'{beehiiv_url}/v2',
+        'BEEHIIV_API_KEY': 'benchmark'
+    })
+    for name in ('RESPONSE_CACHE_PATH', 'SYNC_CHECKPOINTS', 'SYNC_METRICS_REPORT_PATH'):
+        os.environ.pop(name, None)
+    if args.insights_mode:
+        os.environ['FACEBOOK_INSIGHTS_MODE'] = args.insights_mode
+    if args.batch_requests:
+        os.environ['FACEBOOK_BATCH_REQUESTS'] = 'true'
+    if args.structure_mode:
+        os.environ['FACEBOOK_STRUCTURE_MODE'] = args.structure_mode
+    if args.rollups:
+        os.environ['INSIGHT_ROLLUPS'] = 'true'
+    if args.sync_mode:
+        os.environ['DB_SYNC_MODE'] = args.sync_mode
+    if args.db:
+        # libpq aplica PGOPTIONS a todas las conexiones, también a las del pool de la carga en paralelo
+        os.environ['PGOPTIONS'] = f'-c search_path={args.db_schema}'
+
+def column_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'bigint'
+    if isinstance(value, (float, Decimal)):
+        return 'numeric'
+    if isinstance(value, datetime):
+        return 'timestamp'
+    return 'text'
+
+def ensure_benchmark_tables(cursor, rows, sync_tables=(), rollup_columns=()):
+    # Las tablas de datos no las crea el módulo (existen en producción): aquí se crean a partir de
+    # las columnas y la clave de cada tabla, con el tipo deducido del primer valor no nulo.
+    for table_name, table_data in rows.items():
+        if table_name in sync_tables:
+            continue
+        columns = [column.strip() for column in table_data['columns'].strip('()').split(',')]
+        types = []
+        for index, column in enumerate(columns):
+            value = next((row[index] for row in table_data['rows'] if row[index] is not None), None)
+            types.append(f'{column} {column_type(value)}')
+        if table_data.get('rollup'):
+            # Estas métricas no vienen en las filas: las escribe la consulta de INSIGHT_ROLLUPS
+            types += [f'{column} numeric' for column in rollup_columns]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(types)}, UNIQUE {table_data['key']})")
+
+def reset_schema(connection, cursor, schema):
+    if schema == 'public':
+        raise ValueError("--db-schema no puede ser public: el esquema se borra en cada corrida")
+    cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {schema}")
+    connection.commit()
+
+def measure(phases, name, func, trace_memory):
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = func()
+    phase = {'phase': name, 'seconds': round(time.perf_counter() - started, 3)}
+    if trace_memory:
+        phase['peak_mb'] = round((tracemalloc.get_traced_memory()[1] - baseline) / 1024 / 1024, 2)
+    phases.append(phase)
+    logging.info(f"{name}: {phase}")
+    return result
+
+def run_fanout(bd, args):
+    # Cola en el proceso en lugar de Azure Storage Queue: el coordinador encola una unidad por
+    # publicación / cuenta y N hilos hacen de workers
+    sources = [source for source, skipped in (('beehiiv', args.skip_beehiiv), ('facebook', args.skip_facebook)) if not skipped]
+    work_items = queue.Queue()
+    for item in bd.create_work_items(bd.list_sync_units(sources)):
+        work_items.put(item)
+
+    def worker():
+        while True:
+            try:
+                item = work_items.get_nowait()
+            except queue.Empty:
+                return
+            bd.sync_unit(item, args.load_method, args.batch_size)
+
+    with bd.ContextThreadPoolExecutor(max_workers=args.fanout) as pool:
+        for future in [pool.submit(worker) for _ in range(args.fanout)]:
+            future.result()
+
+def server_stats(url):
+    try:
+        return requests.get(f'{url}/__stats', timeout=10).json()
+    except requests.RequestException as e:
+        return {'error': str(e)}
+
+def run_benchmark(args, graph_url, beehiiv_url):
+    import beehiiv_database as bd
+
+    trace_memory = not args.no_memory
+    if trace_memory:
+        tracemalloc.start()
+    metrics = bd.reset_run_metrics()
+    phases = []
+    connection = cursor = None
+    sync_tables = bd.SYNC_TABLES_DDL.keys()
+
+    if args.db:
+        connection, cursor = bd.create_db_connection()
+        reset_schema(connection, cursor, args.db_schema)
+
+    started = time.perf_counter()
+    try:
+        # Sin --db no hay sync_watermarks que leer: la ventana diaria empieza en init_date
+        watermarks = bd.get_sync_watermarks(connection, cursor) if args.db else {}
+        if args.stream:
+            if not args.db:
+                raise ValueError("--stream necesita --db")
+
+            def row_units():
+                beehiiv_units = () if args.skip_beehiiv else bd.fetch_data_from_beehiiv_api(stream=True)
+                facebook_units = () if args.skip_facebook else bd.fetch_data_from_facebook_api(stream=True, watermarks=watermarks)
+                for unit, rows in bd.iter_db_row_units(beehiiv_units, facebook_units):
+                    ensure_benchmark_tables(cursor, rows, sync_tables, bd.INSIGHT_ROLLUP_COLUMNS)
+                    yield unit, rows
+
+            measure(phases, 'stream_db_data', lambda: bd.stream_db_data(connection, cursor, row_units(), args.load_method, args.batch_size), trace_memory)
+        else:
+            beehiiv_info, facebook_info = {}, []
+            if not args.skip_beehiiv:
+                beehiiv_info = measure(phases, 'fetch_data_from_beehiiv_api', bd.fetch_data_from_beehiiv_api, trace_memory)
+            if not args.skip_facebook:
+                facebook_info = measure(phases, 'fetch_data_from_facebook_api', lambda: bd.fetch_data_from_facebook_api(watermarks=watermarks), trace_memory)
+            rows = measure(phases, 'create_db_rows', lambda: bd.create_db_rows(beehiiv_info, facebook_info), trace_memory)
+            if args.db:
+                ensure_benchmark_tables(cursor, rows, sync_tables, bd.INSIGHT_ROLLUP_COLUMNS)
+                connection.commit()
+                if args.parallel:
+                    measure(phases, 'parallel_insert_db_data', lambda: bd.parallel_insert_db_data(rows, args.load_method, args.batch_size), trace_memory)
+                else:
+                    measure(phases, 'insert_db_data', lambda: bd.insert_db_data(connection, cursor, rows, args.load_method, args.batch_size), trace_memory)
+            if args.fanout:
+                if not args.db:
+                    raise ValueError("--fanout necesita --db")
+                measure(phases, 'fanout', lambda: run_fanout(bd, args), trace_memory)
+    finally:
+        total = round(time.perf_counter() - started, 3)
+        if trace_memory:
+            tracemalloc.stop()
+        if connection:
+            connection.close()
+
+    return {
+        'dataset': SyntheticDataset(**dataset_options(args)).describe(),
+        'phases': phases,
+        'total_seconds': total,
+        'run_metrics': metrics.report(),
+        'servers': {'graph': server_stats(graph_url), 'beehiiv': server_stats(beehiiv_url)}
+    }
+
+def print_report(report):
+    print(f"\n{'fase':<32}{'segundos':>10}{'pico MB':>10}")
+    for phase in report['phases']:
+        print(f"{phase['phase']:<32}{phase['seconds']:>10.3f}{phase.get('peak_mb', ''):>10}")
+    print(f"{'total':<32}{report['total_seconds']:>10.3f}")
+
+    run_metrics = report['run_metrics']
+    print(f"\n{'etapa':<32}{'veces':>8}{'segundos':>10}")
+    for name, stage in sorted(run_metrics['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name:<32}{stage['count']:>8}{stage['seconds']:>10.3f}")
+
+    print(f"\n{'endpoint':<40}{'llamadas':>9}{'errores':>9}{'KB':>10}")
+    for endpoint, calls in sorted(run_metrics['http'].items(), key=lambda item: -item[1]['calls']):
+        print(f"{endpoint:<40}{calls['calls']:>9}{calls['errors']:>9}{calls['bytes'] / 1024:>10.1f}")
+    if run_metrics['sleep_seconds']:
+        print(f"\nesperas: {run_metrics['sleep_seconds']}")
+    if run_metrics['imports']:
+        print(f"imports: {run_metrics['imports']}")
+
+    if run_metrics['tables']:
+        print(f"\n{'tabla':<32}{'filas':>10}{'filas/s':>12}")
+        for table_name, table in run_metrics['tables'].items():
+            print(f"{table_name:<32}{table['rows']:>10}{table['rows_per_second']:>12}")
+
+    print(f"\nservidores: {json.dumps(report['servers'])}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+    process, graph_url, beehiiv_url = start_servers(args)
+    try:
+        if args.serve_only:
+            print(f"FACEBOOK_GRAPH_URL={graph_url}\nBEEHIIV_API_URL={beehiiv_url}/v2")
+            process.join()
+            return
+        configure_environment(args, graph_url, beehiiv_url)
+        report = run_benchmark(args, graph_url, beehiiv_url)
+    finally:
+        process.terminate()
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import zlib
+from datetime import date, timedelta
+
+# Datos sintéticos deterministas para los servidores falsos: los mismos parámetros generan
+# siempre los mismos ids y métricas, sin guardar nada en memoria (todo se calcula al pedirlo).
+REGIONS = ['California', 'Texas', 'New York', 'Florida', 'Illinois', 'Ohio', 'Georgia', 'Washington', 'Arizona', 'Colorado', 'Oregon', 'Nevada']
+AGE_BUCKETS = ['13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+GENDERS = ['female', 'male', 'unknown']
+CREATED_TIME = '2024-01-01T00:00:00+0000'
+
+class SyntheticDataset:
+    def __init__(self, accounts=3, campaigns=5, ad_sets=4, ads=3, regions=5, age_buckets=4, genders=2, days=7,
+                 publications=3, posts=20, segments=3, urls_per_post=3, business_id='1'):
+        self.accounts = accounts
+        self.campaigns_per_account = campaigns
+        self.ad_sets_per_campaign = ad_sets
+        self.ads_per_ad_set = ads
+        self.regions = REGIONS[:regions]
+        self.age_buckets = AGE_BUCKETS[:age_buckets]
+        self.genders = GENDERS[:genders]
+        self.days = days
+        self.publications_count = publications
+        self.posts_per_publication = posts
+        self.segments_per_publication = segments
+        self.urls_per_post = urls_per_post
+        self.business_id = business_id
+
+    def describe(self):
+        campaigns = self.accounts * self.campaigns_per_account
+        ad_sets = campaigns * self.ad_sets_per_campaign
+        ads = ad_sets * self.ads_per_ad_set
+        return {
+            'ad_accounts': self.accounts,
+            'campaigns': campaigns,
+            'ad_sets': ad_sets,
+            'ads': ads,
+            'location_rows_per_object': len(self.regions),
+            'audience_rows_per_object': len(self.age_buckets) * len(self.genders),
+            'publications': self.publications_count,
+            'posts': self.publications_count * self.posts_per_publication,
+            'url_rows': self.publications_count * self.posts_per_publication * self.urls_per_post
+        }
+
+    # Graph API
+
+    def ad_accounts(self):
+        return [{
+            'id': f'act_{a}',
+            'account_id': str(a),
+            'name': f'Account {a}',
+            'currency': 'USD',
+            'timezone_name': 'America/Los_Angeles',
+            'created_time': CREATED_TIME
+        } for a in range(self.accounts)]
+
+    def campaigns(self, account_id):
+        account = account_id[4:]
+        return [{
+            'id': f'c{account}_{c}',
+            'account_id': account,
+            'name': f'Campaign {account}-{c}',
+            'objective': 'OUTCOME_TRAFFIC',
+            'status': 'ACTIVE',
+            'created_time': CREATED_TIME,
+            'updated_time': CREATED_TIME,
+            'start_time': CREATED_TIME,
+            'stop_time': '2030-01-01T00:00:00+0000',
+            'daily_budget': str(1000 + c * 100)
+        } for c in range(self.campaigns_per_account)]
+
+    def ad_sets(self, campaign_id):
+        return [{
+            'id': f's{campaign_id[1:]}_{s}',
+            'campaign_id': campaign_id,
+            'name': f'Ad set {campaign_id[1:]}-{s}',
+            'status': 'ACTIVE',
+            'created_time': CREATED_TIME,
+            'updated_time': CREATED_TIME,
+            'start_time': CREATED_TIME,
+            'stop_time': '2030-01-01T00:00:00+0000',
+            'daily_budget': '500',
+            'budget_remaining': '250',
+            'bid_amount': '100',
+            'bid_strategy': 'LOWEST_COST_WITHOUT_CAP',
+            'billing_event': 'IMPRESSIONS',
+            'targeting': {'age_min': 18, 'age_max': 65, 'geo_locations': {'countries': ['US']}}
+        } for s in range(self.ad_sets_per_campaign)]
+
+    def ads(self, ad_set_id):
+        return [{
+            'id': f'd{ad_set_id[1:]}_{d}',
+            'adset_id': ad_set_id,
+            'name': f'Ad {ad_set_id[1:]}-{d}',
+            'status': 'ACTIVE',
+            'created_time': CREATED_TIME,
+            'updated_time': CREATED_TIME
+        } for d in range(self.ads_per_ad_set)]
+
+    def account_objects(self, account_id):
+        campaigns = self.campaigns(account_id)
+        ad_sets = [ad_set for campaign in campaigns for ad_set in self.ad_sets(campaign['id'])]
+        ads = [ad for ad_set in ad_sets for ad in self.ads(ad_set['id'])]
+        return campaigns, ad_sets, ads
+
+    def breakdown_values(self, breakdowns):
+        if 'region' in breakdowns:
+            return [{'region': region, 'country': 'US'} for region in self.regions]
+        if 'age' in breakdowns:
+            return [{'age': age, 'gender': gender} for age in self.age_buckets for gender in self.genders]
+        return [{}]
+
+    def date_ranges(self, time_range, daily):
+        time_range = time_range or {}
+        until = date.fromisoformat(time_range.get('until') or date.today().isoformat())
+        since = date.fromisoformat(time_range.get('since') or (until - timedelta(days=self.days - 1)).isoformat())
+        if not daily:
+            return [(since.isoformat(), until.isoformat())]
+        days = min(self.days, (until - since).days + 1)
+        return [((until - timedelta(days=i)).isoformat(),) * 2 for i in range(days)]
+
+    def insight_row(self, object_id, breakdown, date_start, date_stop):
+        seed = zlib.crc32(f'{object_id}|{sorted(breakdown.items())}|{date_start}'.encode())
+        impressions = 200 + seed % 5000
+        clicks = 1 + seed % 97
+        spend = round(clicks * (0.2 + (seed % 300) / 100), 2)
+        row = {
+            'spend': f'{spend:.2f}',
+            'clicks': str(clicks),
+            'unique_clicks': str(max(1, clicks - seed % 7)),
+            'cpc': f'{spend / clicks:.6f}',
+            'ctr': f'{clicks * 100 / impressions:.6f}',
+            'impressions': str(impressions),
+            'reach': str(impressions - seed % 150),
+            'date_start': date_start,
+            'date_stop': date_stop
+        }
+        row.update(breakdown)
+        return row
+
+    def insights(self, node, params):
+        breakdowns = params.get('breakdowns') or []
+        level = params.get('level')
+        ranges = self.date_ranges(params.get('time_range'), str(params.get('time_increment')) == '1')
+        combos = self.breakdown_values(breakdowns)
+
+        if node.startswith('act_') and level in ('campaign', 'adset', 'ad'):
+            campaigns, ad_sets, ads = self.account_objects(node)
+            if level == 'campaign':
+                objects = [(campaign['id'], {'campaign_id': campaign['id']}) for campaign in campaigns]
+            elif level == 'adset':
+                objects = [(ad_set['id'], {'adset_id': ad_set['id'], 'campaign_id': ad_set['campaign_id']}) for ad_set in ad_sets]
+            else:
+                objects = [(ad['id'], {'ad_id': ad['id'], 'adset_id': ad['adset_id']}) for ad in ads]
+        else:
+            objects = [(node, {})]
+
+        rows = []
+        for object_id, ids in objects:
+            for date_start, date_stop in ranges:
+                for combo in combos:
+                    row = self.insight_row(object_id, combo, date_start, date_stop)
+                    row.update(ids)
+                    rows.append(row)
+        return rows
+
+    # Beehiiv
+
+    def publications(self):
+        return [{'id': f'pub_{p}', 'name': f'Publication {p}', 'organization_name': 'Benchmark'} for p in range(self.publications_count)]
+
+    def publication_stats(self, pub_id):
+        seed = zlib.crc32(pub_id.encode())
+        active = 1000 + seed % 50000
+        return {
+            'active_subscriptions': active,
+            'active_premium_subscriptions': active // 10,
+            'active_free_subscriptions': active - active // 10,
+            'average_open_rate': 40.5,
+            'average_click_rate': 3.2,
+            'total_sent': active * 30,
+            'total_unique_opened': active * 12,
+            'total_clicked': active
+        }
+
+    def segments(self, pub_id):
+        return [{
+            'id': f'seg_{pub_id[4:]}_{s}',
+            'name': f'Segment {s}',
+            'type': 'dynamic',
+            'last_calculated': 1700000000,
+            'total_results': 100 + s,
+            'status': 'completed'
+        } for s in range(self.segments_per_publication)]
+
+    def posts(self, pub_id):
+        return [{'id': f'post_{pub_id[4:]}_{p}'} for p in range(self.posts_per_publication)]
+
+    def post(self, pub_id, post_id):
+        seed = zlib.crc32(post_id.encode())
+        delivered = 1000 + seed % 20000
+        return {
+            'id': post_id,
+            'publish_date': 1700000000 + seed % 10000000,
+            'stats': {
+                'email': {
+                    'recipients': delivered,
+                    'delivered': delivered,
+                    'opens': delivered // 2,
+                    'unique_opens': delivered // 3,
+                    'open_rate': 33.3,
+                    'clicks': delivered // 20,
+                    'unique_clicks': delivered // 25,
+                    'click_rate': 4.0,
+                    'unsubscribes': seed % 10,
+                    'spam_reports': seed % 2
+                },
+                'clicks': [{
+                    'url': f'https://example.com/{post_id}/{u}',
+                    'total_clicks': 10 + u,
+                    'total_unique_clicks': 5 + u,
+                    'total_click_through_rate': 1.5
+                } for u in range(self.urls_per_post)]
+            }
+        }
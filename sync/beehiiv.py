@@ -0,0 +1,167 @@
+import os
+import logging
+import requests
+from datetime import datetime, timezone
+from .cache import get_response_cache
+from .http_client import HTTP_TIMEOUT, bounded_map, create_http_session
+from .metrics import ContextThreadPoolExecutor, timed_stage
+
+BEEHIIV_API_URL = "https://api.beehiiv.com/v2"
+BEEHIIV_PAGE_SIZE = 100
+DEFAULT_BEEHIIV_MAX_WORKERS = 8
+
+def _beehiiv_timestamp(value):
+    return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%d %H:%M:%S') if value else None
+
+def fetch_data_from_beehiiv_api(max_workers=None, stream=False, cache=None, skip_publications=None, only_publications=None, list_only=False):
+    api_headers = {
+        "Accept": "application/json",
+        "Authorization": os.environ["BEEHIIV_API_KEY"],
+    }
+    api_url = os.environ.get('BEEHIIV_API_URL', BEEHIIV_API_URL).rstrip('/')
+    max_workers = max_workers or int(os.environ.get('BEEHIIV_MAX_WORKERS', DEFAULT_BEEHIIV_MAX_WORKERS))
+    cache = cache or get_response_cache()
+    skip_publications = set(skip_publications or ())
+    only_publications = set(only_publications) if only_publications is not None else None
+    # Dos pools (publicaciones y posts) comparten la misma sesión
+    session = create_http_session(pool_size=max_workers * 2, headers=api_headers)
+
+    def get_json(url, params=None):
+        response = session.get(url, params=params, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def get_all_pages(url, params=None):
+        # Soporta la paginación por cursor (next_cursor/has_more) y la antigua por página (page/total_pages)
+        params = dict(params or {}, limit=BEEHIIV_PAGE_SIZE)
+        page = 1
+        while True:
+            body = get_json(url, params)
+            yield from body.get('data', [])
+            if body.get('has_more') and body.get('next_cursor'):
+                params['cursor'] = body['next_cursor']
+            elif 'next_cursor' not in body and page < body.get('total_pages', 1):
+                page += 1
+                params['page'] = page
+            else:
+                return
+
+    def get_post_with_stats(pub, post_id):
+        pub_id = pub['id']
+        post = get_json(f"{api_url}/publications/{pub_id}/posts/{post_id}", {'expand[]': 'stats'}).get('data', {})
+        stats = post.get('stats', {})
+        email_stats = stats.get('email', {})
+        urls = {}
+        for click in stats.get('clicks', []):
+            urls[click['url']] = {
+                'post_id': post_id,
+                'publication_id': pub_id,
+                'url': click['url'],
+                'url_clicks': click.get('total_clicks', 0),
+                'url_unique_clicks': click.get('total_unique_clicks', 0),
+                'url_click_through_rate': click.get('total_click_through_rate', 0.0)
+            }
+        return {
+            'post_id': post_id,
+            'publication_id': pub_id,
+            'publication_name': pub['name'],
+            'publish_date': _beehiiv_timestamp(post.get('publish_date')),
+            'delivered': email_stats.get('delivered', 0),
+            'clicks': email_stats.get('clicks', 0),
+            'unique_clicks': email_stats.get('unique_clicks', 0),
+            'click_rate': email_stats.get('click_rate', 0.0),
+            'opens': email_stats.get('opens', 0),
+            'unique_opens': email_stats.get('unique_opens', 0),
+            'open_rate': email_stats.get('open_rate', 0.0),
+            'unsubscribes': email_stats.get('unsubscribes', 0),
+            'spam_reports': email_stats.get('spam_reports', 0),
+            'urls': urls
+        }
+
+    @timed_stage('beehiiv.publication')
+    def get_publication_data(pub, posts_pool):
+        pub_id = pub['id']
+        url = f"{api_url}/publications/{pub_id}"
+
+        # Obtener estadísticas de la publicación
+        stats = get_json(f"{url}/stats").get('data', {})
+
+        segments = [
+            {
+                'publication_id': pub_id,
+                'publication_name': pub['name'],
+                'segment_id': segment['id'],
+                'segment_name': segment.get('name'),
+                'segment_type': segment.get('type'),
+                'last_calculated': _beehiiv_timestamp(segment.get('last_calculated')),
+                'total_results': segment.get('total_results', 0),
+                'status': segment.get('status')
+            }
+            for segment in get_all_pages(f"{url}/segments")
+        ]
+
+        # Las estadísticas de cada post se piden en paralelo en el pool de posts
+        post_ids = [post['id'] for post in get_all_pages(f"{url}/posts", {'status': 'confirmed'})]
+        posts = list(posts_pool.map(lambda post_id: get_post_with_stats(pub, post_id), post_ids))
+
+        logging.info(f"Processed publication: {pub['name']} ({len(posts)} posts, {len(segments)} segments)")
+
+        # Estructurar datos según el esquema de la tabla
+        return {
+            'publication_id': pub_id,
+            'publication_name': pub['name'],
+            'organization_name': pub['organization_name'],
+            'active_subscriptions': stats.get('active_subscriptions', 0),
+            'active_premium_subscriptions': stats.get('active_premium_subscriptions', 0),
+            'active_free_subscriptions': stats.get('active_free_subscriptions', 0),
+            'average_open_rate': stats.get('average_open_rate', 0.0),
+            'average_click_rate': stats.get('average_click_rate', 0.0),
+            'total_sent': stats.get('total_sent', 0),
+            'total_unique_opened': stats.get('total_unique_opened', 0),
+            'total_clicked': stats.get('total_clicked', 0),
+            'publication_segments': segments,
+            'publication_posts': posts
+        }
+    
+    def get_publications():
+        publications_url = f"{api_url}/publications"
+        if cache:
+            publications = cache.get_or_fetch('publications', publications_url, lambda: list(get_all_pages(publications_url)))
+        else:
+            publications = list(get_all_pages(publications_url))
+        # Las publicaciones ya cargadas en una corrida que se retoma no se vuelven a pedir;
+        # un worker (only_publications) pide solo la suya
+        return [
+            pub for pub in publications
+            if pub['id'] not in skip_publications and (only_publications is None or pub['id'] in only_publications)
+        ]
+
+    def iter_publications_data():
+        try:
+            publications = get_publications()
+
+            # Procesar cada publicación
+            with ContextThreadPoolExecutor(max_workers=max_workers) as publications_pool, ContextThreadPoolExecutor(max_workers=max_workers) as posts_pool:
+                for pub in bounded_map(publications_pool, lambda pub: get_publication_data(pub, posts_pool), publications, max_workers if stream else None):
+                    yield pub['publication_id'], pub
+
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Beehiiv API Error: {str(e)}")
+            raise
+        finally:
+            session.close()
+
+    # list_only: solo la lista de publicaciones, para que el coordinador reparta el trabajo
+    if list_only:
+        try:
+            return get_publications()
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Beehiiv API Error: {str(e)}")
+            raise
+        finally:
+            session.close()
+
+    # En modo stream se devuelve un generador de (publication_id, datos) en vez del dict completo
+    if stream:
+        return iter_publications_data()
+    return dict(iter_publications_data())
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Caché local de respuestas de metadatos (cuentas, campañas, ad sets, ads, publicaciones).
+# Los insights y estadísticas no se guardan: cambian en cada corrida.
+RESPONSE_CACHE_TTLS = {
+    'ad_accounts': 24 * 3600,
+    'campaigns': 6 * 3600,
+    'ad_sets': 6 * 3600,
+    'ads': 6 * 3600,
+    'publications': 24 * 3600
+}
+DEFAULT_RESPONSE_CACHE_MAX_MB = 256
+
+class ResponseCache:
+    # Caché en SQLite indexada por tipo de objeto + endpoint + parámetros. Cada tipo tiene su TTL;
+    # las entradas vencidas se conservan para poder renovarlas sin volver a descargarlas, y
+    # cuando el archivo supera max_bytes se borran las menos usadas recientemente.
+    def __init__(self, path, max_bytes=DEFAULT_RESPONSE_CACHE_MAX_MB * 1024 * 1024, ttls=None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(RESPONSE_CACHE_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _key(kind, key):
+        return json.dumps([kind, key], sort_keys=True, default=str)
+
+    def get(self, kind, key):
+        # Devuelve (valor, vigente); (None, False) si no está en la caché
+        cache_key = self._key(kind, key)
+        with self._lock:
+            row = self._connection.execute("SELECT value, stored_at FROM responses WHERE key = ?", (cache_key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None, False
+            now = time.time()
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, cache_key))
+            fresh = now - row[1] < self.ttls.get(kind, 0)
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return json.loads(row[0]), fresh
+
+    def touch(self, kind, key):
+        # La fuente confirmó que la entrada sigue vigente: vuelve a contar su TTL
+        with self._lock:
+            self._connection.execute("UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), self._key(kind, key)))
+
+    def set(self, kind, key, value):
+        value = json.dumps(value, default=str)
+        now = time.time()
+        with self._lock:
+            cache_key = self._key(kind, key)
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (cache_key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, kind, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, kind, value, len(value), now, now)
+            )
+            self._size += len(value) - (previous[0] if previous else 0)
+            while self._size > self.max_bytes:
+                oldest = self._connection.execute("SELECT key, size FROM responses WHERE key != ? ORDER BY accessed_at LIMIT 10", (cache_key,)).fetchall()
+                if not oldest:
+                    break
+                self._connection.executemany("DELETE FROM responses WHERE key = ?", [(old_key,) for old_key, _ in oldest])
+                self._size -= sum(size for _, size in oldest)
+
+    def get_or_fetch(self, kind, key, fetch):
+        value, fresh = self.get(kind, key)
+        if not fresh:
+            value = fetch()
+            self.set(kind, key, value)
+        return value
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    # Una caché por proceso, abierta la primera vez; sin RESPONSE_CACHE_PATH no hay caché
+    global _response_cache
+    path = os.environ.get('RESPONSE_CACHE_PATH')
+    if not path:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            max_mb = float(os.environ.get('RESPONSE_CACHE_MAX_MB', DEFAULT_RESPONSE_CACHE_MAX_MB))
+            _response_cache = ResponseCache(path, max_bytes=int(max_mb * 1024 * 1024))
+        return _response_cache
@@ -0,0 +1,829 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import psycopg2
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from . import metrics
+from .metrics import ContextThreadPoolExecutor
+from .rows import DEFAULT_SYNC_MODE, rollup_ad_account_ids
+
+def db_connection_params():
+    return {
+        'host': os.environ["DB_HOST"],
+        'database': os.environ["DB_DATABASE"],
+        'user': os.environ["DB_USER"],
+        'password': os.environ["DB_PASSWORD"],
+        'port': os.environ["DB_PORT"]
+    }
+
+def create_db_connection():
+    try:
+        connection = psycopg2.connect(**db_connection_params())
+        cursor = connection.cursor()
+        return connection, cursor
+    except Exception as e:
+        logging.error(f"Error connecting to database: {str(e)}")
+        raise
+
+def create_db_pool(max_connections):
+    try:
+        return ThreadedConnectionPool(1, max_connections, **db_connection_params())
+    except Exception as e:
+        logging.error(f"Error connecting to database: {str(e)}")
+        raise
+
+DEFAULT_LOAD_METHOD = 'copy'
+DEFAULT_BATCH_SIZE = 10000
+
+# Columnas que cambian en cada corrida y no cuentan como cambio de contenido
+VOLATILE_COLUMNS = {'updated_time'}
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).translate(_COPY_ESCAPES)
+
+class CopyRowStream:
+    # Objeto tipo archivo que codifica las filas en formato texto de COPY bajo demanda,
+    # de a `batch_size` filas por lectura, sin materializar la tabla completa en memoria.
+    def __init__(self, rows, batch_size=DEFAULT_BATCH_SIZE):
+        self._rows = iter(rows)
+        self._batch_size = batch_size
+        self.row_count = 0
+
+    def read(self, size=-1):
+        lines = []
+        for row in self._rows:
+            lines.append('\t'.join(_copy_value(value) for value in row))
+            if len(lines) >= self._batch_size:
+                break
+        if not lines:
+            return ''
+        self.row_count += len(lines)
+        return '\n'.join(lines) + '\n'
+
+def copy_rows(cursor, table_name, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+    stream = CopyRowStream(rows, batch_size)
+    cursor.copy_expert(f"COPY {table_name} {columns} FROM STDIN", stream)
+    return stream.row_count
+
+def execute_values_rows(cursor, table_name, columns, rows, batch_size=DEFAULT_BATCH_SIZE):
+    row_count = 0
+
+    def counted(rows):
+        nonlocal row_count
+        for row in rows:
+            row_count += 1
+            yield row
+
+    execute_values(cursor, f"INSERT INTO {table_name} {columns} VALUES %s", counted(rows), page_size=batch_size)
+    return row_count
+
+LOAD_METHODS = {
+    'copy': copy_rows,
+    'execute_values': execute_values_rows
+}
+
+def write_table_rows(cursor, table_name, columns, rows, method=None, batch_size=None):
+    method = method or os.environ.get('DB_LOAD_METHOD', DEFAULT_LOAD_METHOD)
+    batch_size = batch_size or int(os.environ.get('DB_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    if method not in LOAD_METHODS:
+        raise ValueError(f"Unknown load method: {method}")
+    return LOAD_METHODS[method](cursor, table_name, columns, rows, batch_size)
+
+# Tablas propias de la sincronización incremental, creadas si no existen
+SYNC_TABLES_DDL = {
+    'sync_runs': """
+        CREATE TABLE IF NOT EXISTS sync_runs (
+            run_id TEXT PRIMARY KEY,
+            started_at TIMESTAMP NOT NULL,
+            finished_at TIMESTAMP
+        )
+    """,
+    'sync_checkpoints': """
+        CREATE TABLE IF NOT EXISTS sync_checkpoints (
+            run_id TEXT NOT NULL,
+            source TEXT NOT NULL,
+            unit_id TEXT NOT NULL,
+            completed_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (run_id, source, unit_id)
+        )
+    """,
+    'sync_run_tables': """
+        CREATE TABLE IF NOT EXISTS sync_run_tables (
+            run_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            spec JSONB NOT NULL,
+            PRIMARY KEY (run_id, table_name)
+        )
+    """,
+    'sync_watermarks': """
+        CREATE TABLE IF NOT EXISTS sync_watermarks (
+            object_level TEXT NOT NULL,
+            object_id TEXT NOT NULL,
+            last_synced_date DATE NOT NULL,
+            updated_time TIMESTAMP,
+            PRIMARY KEY (object_level, object_id)
+        )
+    """,
+    'ad_set_audience_daily_table': """
+        CREATE TABLE IF NOT EXISTS ad_set_audience_daily_table (
+            ad_set_id TEXT NOT NULL,
+            campaign_id TEXT,
+            date DATE NOT NULL,
+            age TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            spend NUMERIC,
+            clicks NUMERIC,
+            unique_clicks NUMERIC,
+            impressions NUMERIC,
+            reach NUMERIC,
+            cost_per_click NUMERIC,
+            click_through_rate NUMERIC,
+            updated_time TIMESTAMP,
+            PRIMARY KEY (ad_set_id, date, age, gender)
+        )
+    """,
+    'ad_set_location_daily_table': """
+        CREATE TABLE IF NOT EXISTS ad_set_location_daily_table (
+            ad_set_id TEXT NOT NULL,
+            campaign_id TEXT,
+            date DATE NOT NULL,
+            region TEXT NOT NULL,
+            country TEXT NOT NULL,
+            spend NUMERIC,
+            clicks NUMERIC,
+            unique_clicks NUMERIC,
+            impressions NUMERIC,
+            reach NUMERIC,
+            cost_per_click NUMERIC,
+            click_through_rate NUMERIC,
+            updated_time TIMESTAMP,
+            PRIMARY KEY (ad_set_id, date, region, country)
+        )
+    """,
+    'ad_audience_daily_table': """
+        CREATE TABLE IF NOT EXISTS ad_audience_daily_table (
+            ad_id TEXT NOT NULL,
+            ad_set_id TEXT,
+            date DATE NOT NULL,
+            age TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            spend NUMERIC,
+            clicks NUMERIC,
+            unique_clicks NUMERIC,
+            impressions NUMERIC,
+            reach NUMERIC,
+            cost_per_click NUMERIC,
+            click_through_rate NUMERIC,
+            updated_time TIMESTAMP,
+            PRIMARY KEY (ad_id, date, age, gender)
+        )
+    """,
+    'ad_location_daily_table': """
+        CREATE TABLE IF NOT EXISTS ad_location_daily_table (
+            ad_id TEXT NOT NULL,
+            ad_set_id TEXT,
+            date DATE NOT NULL,
+            region TEXT NOT NULL,
+            country TEXT NOT NULL,
+            spend NUMERIC,
+            clicks NUMERIC,
+            unique_clicks NUMERIC,
+            impressions NUMERIC,
+            reach NUMERIC,
+            cost_per_click NUMERIC,
+            click_through_rate NUMERIC,
+            updated_time TIMESTAMP,
+            PRIMARY KEY (ad_id, date, region, country)
+        )
+    """
+}
+
+def ensure_sync_tables(cursor, table_names=None):
+    for table_name, ddl in SYNC_TABLES_DDL.items():
+        if table_names is None or table_name in table_names:
+            cursor.execute("SELECT to_regclass(%s)", (table_name,))
+            if cursor.fetchone()[0] is not None:
+                continue
+            # Dos CREATE TABLE IF NOT EXISTS a la vez (workers del fan-out) chocan en el catálogo:
+            # con el candado el segundo espera al commit del primero y ya no crea nada
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table_name,))
+            cursor.execute(ddl)
+
+def get_sync_watermarks(connection, cursor):
+    # Devuelve {(object_level, object_id): 'YYYY-MM-DD'} para fetch_data_from_facebook_api(watermarks=...)
+    try:
+        ensure_sync_tables(cursor, ['sync_watermarks'])
+        cursor.execute("SELECT object_level, object_id, last_synced_date FROM sync_watermarks")
+        watermarks = {(object_level, object_id): last_synced_date.strftime('%Y-%m-%d') for object_level, object_id, last_synced_date in cursor.fetchall()}
+        connection.commit()
+        return watermarks
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Error leyendo marcas de sincronización: {str(e)}")
+        raise
+
+def _column_names(columns):
+    return [column.strip() for column in columns.strip('()').split(',')]
+
+def _ensure_natural_key_index(cursor, table_name, key_columns):
+    # ON CONFLICT necesita un índice único sobre la clave natural
+    def has_natural_key_index():
+        cursor.execute("""
+            SELECT 1
+            FROM pg_index i
+            WHERE i.indrelid = %s::regclass
+              AND i.indisunique
+              AND i.indpred IS NULL
+              AND (
+                  SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+                  FROM pg_attribute a
+                  WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+              ) = %s
+        """, (table_name, sorted(key_columns)))
+        return cursor.fetchone() is not None
+
+    if has_natural_key_index():
+        return
+    # Varios workers del fan-out pueden llegar a la vez a una tabla sin índice: el candado (hasta el
+    # commit) deja que uno solo lo cree y los demás, al volver a mirar, ya lo encuentran
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{table_name}_natural_key",))
+    if not has_natural_key_index():
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_natural_key ON {table_name} ({', '.join(key_columns)})")
+
+def replace_table_rows(cursor, table_name, table_data, method=None, batch_size=None):
+    # La tabla ya fue truncada por prepare_db_tables
+    if not table_data['rows']:
+        return 0
+    return write_table_rows(cursor, table_name, table_data['columns'], table_data['rows'], method, batch_size)
+
+def upsert_table_rows(cursor, table_name, table_data, method=None, batch_size=None):
+    columns = _column_names(table_data['columns'])
+    key_columns = _column_names(table_data['key'])
+    compared_columns = [column for column in columns if column not in key_columns and column not in VOLATILE_COLUMNS]
+    staging_table = f"{table_name}__upsert"
+
+    _ensure_natural_key_index(cursor, table_name, key_columns)
+    cursor.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    staged = write_table_rows(cursor, staging_table, table_data['columns'], table_data['rows'], method, batch_size)
+
+    column_list = ', '.join(columns)
+    key_list = ', '.join(key_columns)
+    if compared_columns:
+        # Solo se reescriben las filas cuyo contenido cambió (ignorando columnas como updated_time)
+        update_list = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in key_columns)
+        current = ', '.join(f"{table_name}.{column}" for column in compared_columns)
+        incoming = ', '.join(f"EXCLUDED.{column}" for column in compared_columns)
+        conflict_action = f"DO UPDATE SET {update_list} WHERE ROW({current}) IS DISTINCT FROM ROW({incoming})"
+    else:
+        conflict_action = "DO NOTHING"
+
+    cursor.execute(f"""
+        INSERT INTO {table_name} ({column_list})
+        SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging_table}
+        ON CONFLICT ({key_list}) {conflict_action}
+    """)
+    changed = cursor.rowcount
+
+    if table_data.get('delete_missing'):
+        # Las claves vistas se acumulan durante toda la carga; el borrado se hace al final
+        cursor.execute(f"INSERT INTO {table_name}__seen ({key_list}) SELECT {key_list} FROM {staging_table}")
+
+    cursor.execute(f"DROP TABLE {staging_table}")
+    logging.info(f"{table_name}: {staged} filas recibidas, {changed} insertadas/actualizadas")
+    return staged
+
+def create_seen_table(cursor, table_name, table_data, durable=False):
+    # durable: la tabla sobrevive a los commits intermedios de una corrida con checkpoints
+    if table_data.get('mode', DEFAULT_SYNC_MODE) == 'upsert' and table_data.get('delete_missing'):
+        key_list = ', '.join(_column_names(table_data['key']))
+        if durable:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}__seen")
+            cursor.execute(f"CREATE UNLOGGED TABLE {table_name}__seen AS SELECT {key_list} FROM {table_name} WITH NO DATA")
+        else:
+            cursor.execute(f"CREATE TEMP TABLE {table_name}__seen ON COMMIT DROP AS SELECT {key_list} FROM {table_name} WITH NO DATA")
+
+def delete_missing_rows(cursor, table_name, table_data):
+    key_columns = _column_names(table_data['key'])
+    seen_table = f"{table_name}__seen"
+    deleted = 0
+    # Una fuente vacía suele indicar un fallo de la API, no que se borraron todos los datos
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {seen_table})")
+    if cursor.fetchone()[0]:
+        key_match = ' AND '.join(f"s.{column} IS NOT DISTINCT FROM t.{column}" for column in key_columns)
+        # Con scope (worker de una sola unidad) solo se consideran las filas de esa unidad
+        scope, scope_params = table_data.get('scope') or ('TRUE', None)
+        cursor.execute(f"""
+            DELETE FROM {table_name} t
+            WHERE NOT EXISTS (SELECT 1 FROM {seen_table} s WHERE {key_match})
+              AND ({scope})
+        """, scope_params)
+        deleted = cursor.rowcount
+    cursor.execute(f"DROP TABLE {seen_table}")
+    logging.info(f"{table_name}: {deleted} filas eliminadas")
+    return deleted
+
+def get_foreign_keys(cursor, table_names):
+    # Claves foráneas que salen o llegan a alguna de las tablas: (nombre, tabla, tabla referenciada, definición)
+    table_names = list(table_names)
+    cursor.execute("""
+        SELECT c.conname, c.conrelid::regclass::text, c.confrelid::regclass::text, pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        WHERE c.contype = 'f'
+          AND (c.conrelid = ANY(%s::regclass[]) OR c.confrelid = ANY(%s::regclass[]))
+    """, (table_names, table_names))
+    return cursor.fetchall()
+
+def _staging_name(name):
+    # Nombre temporal de índices y restricciones de la copia (los identificadores tienen hasta 63 caracteres)
+    return f"{name[:54]}__staging"
+
+def get_table_indexes(cursor, table_name):
+    # (índice, definición, restricción que lo usa o None, definición de la restricción)
+    cursor.execute("""
+        SELECT i.relname, pg_get_indexdef(i.oid), c.conname, pg_get_constraintdef(c.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid AND c.conrelid = x.indrelid AND c.contype IN ('p', 'u', 'x')
+        WHERE x.indrelid = %s::regclass
+        ORDER BY i.relname
+    """, (table_name,))
+    return cursor.fetchall()
+
+def create_staging_table(cursor, table_name):
+    # Copia sin índices ni WAL de la tabla; los índices se crean después de la carga masiva
+    staging_table = f"{table_name}__staging"
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    cursor.execute(f"CREATE UNLOGGED TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY INCLUDING GENERATED INCLUDING STORAGE)")
+
+def build_staging_indexes(cursor, table_name):
+    staging_table = f"{table_name}__staging"
+    cursor.execute(f"ALTER TABLE {staging_table} SET LOGGED")
+    for index_name, index_definition, constraint_name, constraint_definition in get_table_indexes(cursor, table_name):
+        if constraint_name:
+            cursor.execute(f'ALTER TABLE {staging_table} ADD CONSTRAINT "{_staging_name(constraint_name)}" {constraint_definition}')
+        else:
+            index_definition = re.sub(r'^(CREATE (?:UNIQUE )?INDEX )\S+ ON (ONLY )?\S+', lambda match: f'{match.group(1)}"{_staging_name(index_name)}" ON {staging_table}', index_definition)
+            cursor.execute(index_definition)
+    cursor.execute(f"ANALYZE {staging_table}")
+
+_POLICY_COMMANDS = {'r': 'SELECT', 'a': 'INSERT', 'w': 'UPDATE', 'd': 'DELETE', '*': 'ALL'}
+
+def copy_table_metadata(cursor, table_name):
+    # CREATE TABLE ... (LIKE ...) no copia dueño, permisos, comentarios, triggers ni políticas RLS:
+    # sin esto, los roles de solo lectura (dashboards) pierden el acceso con el primer intercambio
+    staging_table = f"{table_name}__staging"
+    cursor.execute("""
+        SELECT quote_ident(pg_get_userbyid(relowner)), obj_description(oid, 'pg_class'), relrowsecurity, relforcerowsecurity
+        FROM pg_class
+        WHERE oid = %s::regclass
+    """, (table_name,))
+    owner, comment, row_security, force_row_security = cursor.fetchone()
+    cursor.execute(f"ALTER TABLE {staging_table} OWNER TO {owner}")
+    cursor.execute(f"COMMENT ON TABLE {staging_table} IS %s", (comment,))
+
+    # Permisos de la tabla (attname NULL) y de cada columna; el grantee 0 es PUBLIC
+    cursor.execute("""
+        SELECT NULL, a.privilege_type, CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = %s::regclass
+        UNION ALL
+        SELECT quote_ident(t.attname), a.privilege_type, CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(a.grantee)) END, a.is_grantable
+        FROM pg_attribute t, aclexplode(t.attacl) a
+        WHERE t.attrelid = %s::regclass AND t.attnum > 0 AND NOT t.attisdropped
+    """, (table_name, table_name))
+    for column_name, privilege, grantee, grantable in cursor.fetchall():
+        columns = f" ({column_name})" if column_name else ''
+        cursor.execute(f"GRANT {privilege}{columns} ON {staging_table} TO {grantee}{' WITH GRANT OPTION' if grantable else ''}")
+
+    cursor.execute("""
+        SELECT quote_ident(attname), col_description(attrelid, attnum)
+        FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND col_description(attrelid, attnum) IS NOT NULL
+    """, (table_name,))
+    for column_name, column_comment in cursor.fetchall():
+        cursor.execute(f"COMMENT ON COLUMN {staging_table}.{column_name} IS %s", (column_comment,))
+
+    # Los triggers se crean después de la carga masiva para que no se disparen con las filas copiadas
+    cursor.execute("""
+        SELECT quote_ident(tgname), pg_get_triggerdef(oid), tgenabled
+        FROM pg_trigger
+        WHERE tgrelid = %s::regclass AND NOT tgisinternal
+    """, (table_name,))
+    for trigger_name, trigger_definition, enabled in cursor.fetchall():
+        trigger_definition = re.sub(r'^(CREATE (?:CONSTRAINT )?TRIGGER .+? ON )\S+', lambda match: f'{match.group(1)}{staging_table}', trigger_definition)
+        cursor.execute(trigger_definition)
+        if enabled == 'D':
+            cursor.execute(f"ALTER TABLE {staging_table} DISABLE TRIGGER {trigger_name}")
+        elif enabled in ('R', 'A'):
+            cursor.execute(f"ALTER TABLE {staging_table} ENABLE {'REPLICA' if enabled == 'R' else 'ALWAYS'} TRIGGER {trigger_name}")
+
+    if row_security:
+        cursor.execute(f"ALTER TABLE {staging_table} ENABLE ROW LEVEL SECURITY")
+    if force_row_security:
+        cursor.execute(f"ALTER TABLE {staging_table} FORCE ROW LEVEL SECURITY")
+    cursor.execute("""
+        SELECT quote_ident(polname), polpermissive, polcmd,
+               ARRAY(SELECT CASE WHEN role = 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(role)) END FROM unnest(polroles) role),
+               pg_get_expr(polqual, polrelid), pg_get_expr(polwithcheck, polrelid)
+        FROM pg_policy
+        WHERE polrelid = %s::regclass
+    """, (table_name,))
+    for policy_name, permissive, command, roles, using, with_check in cursor.fetchall():
+        cursor.execute(
+            f"CREATE POLICY {policy_name} ON {staging_table} AS {'PERMISSIVE' if permissive else 'RESTRICTIVE'} "
+            f"FOR {_POLICY_COMMANDS[command]} TO {', '.join(roles)}"
+            f"{f' USING ({using})' if using else ''}{f' WITH CHECK ({with_check})' if with_check else ''}"
+        )
+
+DEFAULT_SWAP_LOCK_TIMEOUT = '2s'
+DEFAULT_SWAP_ATTEMPTS = 5
+SWAP_RETRY_WAIT = 1
+
+def swap_staging_tables(cursor, table_names, foreign_keys):
+    # Los renombres piden ACCESS EXCLUSIVE: si una consulta larga (un dashboard) tiene la tabla, el
+    # intercambio espera y todas las lecturas siguientes hacen cola detrás de él. Con lock_timeout
+    # corto el intento se abandona (hasta el savepoint, sin perder la carga) y se reintenta.
+    lock_timeout = os.environ.get('DB_SWAP_LOCK_TIMEOUT', DEFAULT_SWAP_LOCK_TIMEOUT)
+    attempts = int(os.environ.get('DB_SWAP_ATTEMPTS', DEFAULT_SWAP_ATTEMPTS))
+    for attempt in range(attempts):
+        cursor.execute("SAVEPOINT swap_staging_tables")
+        cursor.execute("SET LOCAL lock_timeout = %s", (lock_timeout,))
+        try:
+            related_keys = rename_staging_tables(cursor, table_names, foreign_keys)
+        except psycopg2.errors.LockNotAvailable:
+            cursor.execute("ROLLBACK TO SAVEPOINT swap_staging_tables")
+            if attempt == attempts - 1:
+                raise
+            logging.warning(f"Intercambio de tablas bloqueado por otras consultas, reintento {attempt + 1} de {attempts - 1}")
+            wait = SWAP_RETRY_WAIT * (attempt + 1)
+            time.sleep(wait)
+            metrics.run_metrics.record_sleep('db_swap_lock', wait)
+            continue
+        cursor.execute("RELEASE SAVEPOINT swap_staging_tables")
+        cursor.execute("SET LOCAL lock_timeout = DEFAULT")
+        return related_keys
+
+def rename_staging_tables(cursor, table_names, foreign_keys):
+    # Intercambia las tablas por sus copias __staging en la transacción del cursor (solo renombres,
+    # el bloqueo dura lo que tarda el commit). Las claves foráneas se quitan y se vuelven a crear
+    # NOT VALID sobre las tablas nuevas; hay que validarlas con validate_foreign_keys tras el commit.
+    # Las tablas fuera de la carga que referencian a una tabla intercambiada se vacían, como hacía
+    # TRUNCATE ... CASCADE. Devuelve las claves foráneas recreadas.
+    related_keys = [foreign_key for foreign_key in foreign_keys if foreign_key[1] in table_names or foreign_key[2] in table_names]
+    referencing_tables = sorted({table_name for _, table_name, _, _ in related_keys if table_name not in table_names})
+    table_indexes = {table_name: get_table_indexes(cursor, table_name) for table_name in table_names}
+    for table_name in table_names:
+        copy_table_metadata(cursor, table_name)
+
+    for constraint_name, table_name, _, _ in related_keys:
+        cursor.execute(f'ALTER TABLE {table_name} DROP CONSTRAINT "{constraint_name}"')
+    for table_name in table_names:
+        cursor.execute(f"ALTER TABLE {table_name} RENAME TO {table_name}__old")
+        cursor.execute(f"ALTER TABLE {table_name}__staging RENAME TO {table_name}")
+        # Las secuencias de columnas serial pertenecen a la tabla vieja y se borrarían con ella
+        cursor.execute("""
+            SELECT s.oid::regclass::text, a.attname
+            FROM pg_depend d
+            JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+            JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+            WHERE d.refobjid = %s::regclass AND d.deptype = 'a'
+        """, (f"{table_name}__old",))
+        for sequence_name, column_name in cursor.fetchall():
+            cursor.execute(f'ALTER SEQUENCE {sequence_name} OWNED BY {table_name}."{column_name}"')
+    cursor.execute(f"DROP TABLE {', '.join(f'{table_name}__old' for table_name in table_names)}")
+    if referencing_tables:
+        cursor.execute(f"TRUNCATE TABLE {', '.join(referencing_tables)}")
+
+    # Los índices y restricciones recuperan el nombre que tenían en la tabla vieja
+    for table_name, indexes in table_indexes.items():
+        for index_name, _, constraint_name, _ in indexes:
+            if constraint_name:
+                cursor.execute(f'ALTER TABLE {table_name} RENAME CONSTRAINT "{_staging_name(constraint_name)}" TO "{constraint_name}"')
+            else:
+                cursor.execute(f'ALTER INDEX "{_staging_name(index_name)}" RENAME TO "{index_name}"')
+
+    for constraint_name, table_name, _, definition in related_keys:
+        cursor.execute(f'ALTER TABLE {table_name} ADD CONSTRAINT "{constraint_name}" {definition} NOT VALID')
+    return related_keys
+
+def validate_foreign_keys(connection, cursor, foreign_keys):
+    # VALIDATE CONSTRAINT no bloquea lecturas ni escrituras; si falla, la clave queda NOT VALID
+    # (sigue aplicándose a las filas nuevas) y los datos ya publicados se mantienen
+    for constraint_name, table_name, _, _ in foreign_keys:
+        try:
+            cursor.execute(f'ALTER TABLE {table_name} VALIDATE CONSTRAINT "{constraint_name}"')
+            connection.commit()
+        except psycopg2.Error as e:
+            connection.rollback()
+            logging.warning(f"{table_name}: no se pudo validar {constraint_name}: {str(e)}")
+
+def swap_table_rows(cursor, table_name, table_data, method=None, batch_size=None):
+    # Se escribe en la copia creada por prepare_db_tables; se publica con swap_staging_tables
+    if not table_data['rows']:
+        return 0
+    return write_table_rows(cursor, f"{table_name}__staging", table_data['columns'], table_data['rows'], method, batch_size)
+
+def refresh_rollups(cursor, table_name, table_data, ad_account_ids):
+    # Recalcula en la base las métricas de la tabla (ver INSIGHT_ROLLUPS) solo para las cuentas cargadas
+    if not ad_account_ids:
+        return 0
+    cursor.execute(table_data['rollup'], {'ad_account_ids': sorted(ad_account_ids)})
+    logging.info(f"{table_name}: métricas recalculadas para {len(ad_account_ids)} cuentas, {cursor.rowcount} filas actualizadas")
+    return cursor.rowcount
+
+SYNC_MODES = {
+    'replace': replace_table_rows,
+    'upsert': upsert_table_rows,
+    'swap': swap_table_rows
+}
+
+def _table_spec(table_data):
+    # Especificación de la tabla sin sus filas: lo que se guarda para toda la carga no retiene las
+    # filas de la unidad que la trajo primero
+    return {key: value for key, value in table_data.items() if key != 'rows'}
+
+def prepare_db_tables(cursor, rows, prepared_tables, durable=False):
+    # Se llama con cada unidad; solo prepara (valida, crea, vacía) las tablas que aparecen por primera vez.
+    # Las tablas ya preparadas por una corrida que se retoma vienen registradas (ver get_run_tables).
+    # Devuelve los nombres de las tablas preparadas en esta llamada.
+    new_tables = {table_name: table_data for table_name, table_data in rows.items() if table_name not in prepared_tables}
+    if not new_tables:
+        return []
+    for table_name, table_data in new_tables.items():
+        if table_data.get('mode', DEFAULT_SYNC_MODE) not in SYNC_MODES:
+            raise ValueError(f"Unknown sync mode for {table_name}: {table_data['mode']}")
+
+    ensure_sync_tables(cursor, new_tables.keys())
+
+    # Limpiar tablas existentes (solo las que se recargan completas)
+    replaced_tables = [table_name for table_name, table_data in new_tables.items() if table_data.get('mode', DEFAULT_SYNC_MODE) == 'replace']
+    if replaced_tables:
+        cursor.execute(f"TRUNCATE TABLE {', '.join(replaced_tables)} CASCADE;")
+
+    for table_name, table_data in new_tables.items():
+        if table_data.get('mode', DEFAULT_SYNC_MODE) == 'swap':
+            create_staging_table(cursor, table_name)
+        create_seen_table(cursor, table_name, table_data, durable)
+        prepared_tables[table_name] = {'spec': _table_spec(table_data), 'row_count': 0}
+    return list(new_tables)
+
+SYNC_RESUME_MAX_AGE_HOURS = 24
+
+def start_sync_run(connection, cursor, resume=True):
+    # Con SYNC_CHECKPOINTS activo registra una corrida (o retoma la última sin terminar de las
+    # últimas SYNC_RESUME_MAX_AGE_HOURS horas) y devuelve (run_id, {fuente: ids ya cargados}).
+    # Sin checkpoints devuelve (None, {}) y la carga se hace en una sola transacción.
+    if os.environ.get('SYNC_CHECKPOINTS', 'false').lower() not in ('1', 'true', 'yes'):
+        return None, {}
+    try:
+        ensure_sync_tables(cursor, ['sync_runs', 'sync_checkpoints', 'sync_run_tables'])
+        run = None
+        if resume:
+            cursor.execute(
+                "SELECT run_id FROM sync_runs WHERE finished_at IS NULL AND started_at > %s ORDER BY started_at DESC LIMIT 1",
+                (datetime.now() - timedelta(hours=SYNC_RESUME_MAX_AGE_HOURS),)
+            )
+            run = cursor.fetchone()
+        if run:
+            run_id = run[0]
+            logging.info(f"Retomando la corrida {run_id}")
+        else:
+            run_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+            cursor.execute("INSERT INTO sync_runs (run_id, started_at) VALUES (%s, %s)", (run_id, datetime.now()))
+        completed_units = get_completed_units(cursor, run_id)
+        connection.commit()
+        return run_id, completed_units
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Error iniciando la corrida: {str(e)}")
+        raise
+
+def get_completed_units(cursor, run_id):
+    cursor.execute("SELECT source, unit_id FROM sync_checkpoints WHERE run_id = %s", (run_id,))
+    completed_units = {}
+    for source, unit_id in cursor.fetchall():
+        completed_units.setdefault(source, set()).add(unit_id)
+    return completed_units
+
+def record_checkpoint(cursor, run_id, source, unit_id):
+    cursor.execute(
+        "INSERT INTO sync_checkpoints (run_id, source, unit_id, completed_at) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
+        (run_id, source, unit_id, datetime.now())
+    )
+
+def get_run_tables(cursor, run_id):
+    # Tablas que ya preparó la corrida, en el orden en que aparecieron, con su especificación (sin filas)
+    cursor.execute("SELECT table_name, spec FROM sync_run_tables WHERE run_id = %s ORDER BY position", (run_id,))
+    return dict(cursor.fetchall())
+
+def record_run_table(cursor, run_id, table_name, position, table_data):
+    cursor.execute(
+        "INSERT INTO sync_run_tables (run_id, table_name, position, spec) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
+        (run_id, table_name, position, json.dumps(_table_spec(table_data)))
+    )
+
+def finish_sync_run(cursor, run_id):
+    cursor.execute("UPDATE sync_runs SET finished_at = %s WHERE run_id = %s", (datetime.now(), run_id))
+    cursor.execute("DELETE FROM sync_checkpoints WHERE run_id = %s", (run_id,))
+    cursor.execute("DELETE FROM sync_run_tables WHERE run_id = %s", (run_id,))
+
+def stream_db_data(connection, cursor, row_units, method=None, batch_size=None, run_id=None):
+    # Carga las unidades ((fuente, id), filas) a medida que llegan: la siguiente unidad no se pide
+    # (ni se termina de descargar) hasta que la actual está escrita. Sin run_id todo va en una sola
+    # transacción; con run_id (ver start_sync_run) cada unidad se confirma junto con su checkpoint.
+    try:
+        prepared_tables = {}
+        completed_units = {}
+        if run_id:
+            completed_units = get_completed_units(cursor, run_id)
+            # Las tablas del intento anterior se registran antes de recibir unidades: aunque no quede
+            # ninguna por cargar (o ninguna las traiga), al final se limpian e intercambian igual
+            for table_name, spec in get_run_tables(cursor, run_id).items():
+                prepared_tables[table_name] = {'spec': spec, 'row_count': 0}
+        # Las cuentas ya confirmadas por una corrida que se retoma también se recalculan al final
+        rollup_accounts = set(completed_units.get('facebook', set()))
+        row_units = iter(row_units)
+        while True:
+            # Tiempo que la carga espera a que la descarga entregue la siguiente unidad
+            with metrics.run_metrics.stage('db.wait_for_unit'):
+                unit_rows = next(row_units, None)
+            if unit_rows is None:
+                break
+            unit, rows = unit_rows
+            with metrics.run_metrics.stage('db.load'):
+                new_tables = prepare_db_tables(cursor, rows, prepared_tables, durable=run_id is not None)
+                rollup_accounts |= rollup_ad_account_ids(rows)
+                for table_name, table_data in rows.items():
+                    load_table = SYNC_MODES[table_data.get('mode', DEFAULT_SYNC_MODE)]
+                    started = time.perf_counter()
+                    row_count = load_table(cursor, table_name, table_data, method, batch_size)
+                    metrics.run_metrics.record_table(table_name, row_count, time.perf_counter() - started)
+                    prepared_tables[table_name]['row_count'] += row_count
+                if run_id:
+                    positions = list(prepared_tables)
+                    for table_name in new_tables:
+                        record_run_table(cursor, run_id, table_name, positions.index(table_name), rows[table_name])
+                    record_checkpoint(cursor, run_id, *unit)
+                    connection.commit()
+
+        # Las tablas hijas (ads, ad sets) se limpian antes que sus padres: el scope de cada unidad
+        # llega a sus filas a través de las tablas padre
+        for table_name, prepared in reversed(list(prepared_tables.items())):
+            if prepared['spec'].get('mode', DEFAULT_SYNC_MODE) == 'upsert' and prepared['spec'].get('delete_missing'):
+                delete_missing_rows(cursor, table_name, prepared['spec'])
+        for table_name, prepared in prepared_tables.items():
+            logging.info(f"{table_name}: {prepared['row_count']} filas cargadas")
+
+        swapped_tables = [table_name for table_name, prepared in prepared_tables.items() if prepared['spec'].get('mode', DEFAULT_SYNC_MODE) == 'swap']
+        foreign_keys = []
+        if swapped_tables:
+            with metrics.run_metrics.stage('db.build_indexes'):
+                for table_name in swapped_tables:
+                    build_staging_indexes(cursor, table_name)
+            with metrics.run_metrics.stage('db.swap'):
+                foreign_keys = swap_staging_tables(cursor, swapped_tables, get_foreign_keys(cursor, swapped_tables))
+
+        # Después de borrar e intercambiar: las métricas se calculan sobre las tablas ya publicadas
+        with metrics.run_metrics.stage('db.rollups'):
+            for table_name, prepared in prepared_tables.items():
+                if prepared['spec'].get('rollup'):
+                    refresh_rollups(cursor, table_name, prepared['spec'], rollup_accounts)
+
+        if run_id:
+            finish_sync_run(cursor, run_id)
+        with metrics.run_metrics.stage('db.commit'):
+            connection.commit()
+        with metrics.run_metrics.stage('db.validate_foreign_keys'):
+            validate_foreign_keys(connection, cursor, foreign_keys)
+        logging.info("Datos insertados exitosamente")
+
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Error insertando datos: {str(e)}")
+        raise
+    finally:
+        cursor.close()
+        connection.close()
+
+def insert_db_data(connection, cursor, rows, method=None, batch_size=None):
+    stream_db_data(connection, cursor, [(None, rows)], method, batch_size)
+
+DEFAULT_DB_MAX_CONNECTIONS = 4
+
+def group_related_tables(table_names, foreign_keys):
+    # Las tablas unidas por una clave foránea se cargan juntas, en la misma conexión
+    groups = {table_name: {table_name} for table_name in table_names}
+    for _, table_name, referenced_table, _ in foreign_keys:
+        if table_name in groups and referenced_table in groups and groups[table_name] is not groups[referenced_table]:
+            merged = groups[table_name] | groups[referenced_table]
+            for merged_table in merged:
+                groups[merged_table] = merged
+    unique_groups = {id(group): group for group in groups.values()}.values()
+    return [[table_name for table_name in table_names if table_name in group] for group in unique_groups]
+
+def load_table_group(connection, rows, table_names, method=None, batch_size=None):
+    # Las tablas en modo replace o swap se cargan en su copia <tabla>__staging, que se intercambia
+    # al final; las de modo upsert se actualizan directamente. La transacción queda abierta para quien llama.
+    cursor = connection.cursor()
+    try:
+        for table_name in table_names:
+            table_data = rows[table_name]
+            started = time.perf_counter()
+            if table_data.get('mode', DEFAULT_SYNC_MODE) in ('replace', 'swap'):
+                create_staging_table(cursor, table_name)
+                row_count = swap_table_rows(cursor, table_name, table_data, method, batch_size)
+                build_staging_indexes(cursor, table_name)
+            else:
+                create_seen_table(cursor, table_name, table_data)
+                row_count = upsert_table_rows(cursor, table_name, table_data, method, batch_size)
+                if table_data.get('delete_missing'):
+                    delete_missing_rows(cursor, table_name, table_data)
+            metrics.run_metrics.record_table(table_name, row_count, time.perf_counter() - started)
+            logging.info(f"{table_name}: {row_count} filas cargadas")
+    finally:
+        cursor.close()
+
+def parallel_insert_db_data(rows, method=None, batch_size=None, max_connections=None):
+    # Carga los grupos de tablas en paralelo, cada uno en su conexión, y publica todas las
+    # tablas en modo replace o swap a la vez con un único intercambio al final. Los workers solo
+    # escriben copias __staging (confirmarlas no publica nada); las tablas upsert se escriben en la
+    # transacción del coordinador mientras tanto, así todo lo visible se confirma o deshace junto.
+    max_connections = max_connections or int(os.environ.get('DB_MAX_CONNECTIONS', DEFAULT_DB_MAX_CONNECTIONS))
+    for table_name, table_data in rows.items():
+        if table_data.get('mode', DEFAULT_SYNC_MODE) not in SYNC_MODES:
+            raise ValueError(f"Unknown sync mode for {table_name}: {table_data['mode']}")
+
+    # Una conexión coordina (esquema, tablas upsert e intercambio) y max_connections cargan
+    db_pool = create_db_pool(max_connections + 1)
+    connection = db_pool.getconn()
+    try:
+        cursor = connection.cursor()
+        ensure_sync_tables(cursor, rows.keys())
+        foreign_keys = get_foreign_keys(cursor, rows.keys())
+        connection.commit()
+
+        staged_tables = [table_name for table_name, table_data in rows.items() if table_data.get('mode', DEFAULT_SYNC_MODE) in ('replace', 'swap')]
+        upsert_tables = [table_name for table_name in rows if table_name not in staged_tables]
+        # Los grupos más grandes primero: el tiempo total queda acotado por el grupo más pesado
+        groups = sorted(group_related_tables(staged_tables, foreign_keys), key=lambda group: -sum(len(rows[table_name]['rows']) for table_name in group))
+        worker_connections = []
+        local = threading.local()
+
+        def load_group(table_names):
+            if not hasattr(local, 'connection'):
+                local.connection = db_pool.getconn()
+                worker_connections.append(local.connection)
+            load_table_group(local.connection, rows, table_names, method, batch_size)
+
+        try:
+            with metrics.run_metrics.stage('db.load'), ContextThreadPoolExecutor(max_workers=max_connections) as pool:
+                loads = [pool.submit(load_group, group) for group in groups]
+                if upsert_tables:
+                    load_table_group(connection, rows, upsert_tables, method, batch_size)
+                for load in loads:
+                    load.result()
+            for worker_connection in worker_connections:
+                worker_connection.commit()
+        except Exception:
+            for worker_connection in worker_connections:
+                worker_connection.rollback()
+            raise
+        finally:
+            for worker_connection in worker_connections:
+                db_pool.putconn(worker_connection)
+
+        validated_keys = []
+        if staged_tables:
+            with metrics.run_metrics.stage('db.swap'):
+                validated_keys = swap_staging_tables(cursor, staged_tables, foreign_keys)
+        with metrics.run_metrics.stage('db.rollups'):
+            rollup_accounts = rollup_ad_account_ids(rows)
+            for table_name, table_data in rows.items():
+                if table_data.get('rollup'):
+                    refresh_rollups(cursor, table_name, table_data, rollup_accounts)
+        connection.commit()
+        validate_foreign_keys(connection, cursor, validated_keys)
+        logging.info("Datos insertados exitosamente")
+
+    except Exception as e:
+        connection.rollback()
+        logging.error(f"Error insertando datos: {str(e)}")
+        raise
+    finally:
+        db_pool.closeall()
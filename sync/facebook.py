@@ -0,0 +1,735 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from facebook_business.api import FacebookAdsApi
+from facebook_business.session import FacebookSession
+from facebook_business.adobjects.ad import Ad
+from facebook_business.adobjects.adaccount import AdAccount
+from facebook_business.adobjects.adreportrun import AdReportRun
+from facebook_business.adobjects.adset import AdSet
+from facebook_business.adobjects.campaign import Campaign
+from facebook_business.adobjects.business import Business
+from facebook_business.exceptions import FacebookRequestError
+from . import metrics
+from .cache import get_response_cache
+from .http_client import HTTP_MAX_RETRIES, HTTP_RETRY_STATUSES, HTTP_TIMEOUT, bounded_map, configure_http_session, parse_usage_headers
+from .metrics import ContextThreadPoolExecutor, timed_stage
+from .rows import DAILY_INSIGHTS_LEVELS, index_ad_account, parse_insight
+
+DEFAULT_FACEBOOK_MAX_ACCOUNTS = 4
+DEFAULT_FACEBOOK_ACCOUNT_WORKERS = 4
+DEFAULT_FACEBOOK_INSIGHTS_MODE = 'object'
+FACEBOOK_GRAPH_URL = 'https://graph.facebook.com'
+FACEBOOK_GRAPH_VERSION = 'v20.0'
+GRAPH_BATCH_SIZE = 50
+DEFAULT_FACEBOOK_STRUCTURE_MODE = 'edges'
+EXPAND_PAGE_SIZE = 25
+EXPAND_NESTED_PAGE_SIZE = 100
+# "Please reduce the amount of data you're asking for": la expansión anidada devolvió demasiado
+GRAPH_DATA_TOO_LARGE_ERROR_CODE = 1
+# Ese error llega con HTTP 500: la consulta expandida no reintenta los 500 para caer enseguida a los edges
+EXPAND_RETRY_STATUSES = tuple(status for status in HTTP_RETRY_STATUSES if status != 500)
+# Método del SDK -> edge de la Graph API, para pedir los mismos edges dentro de un batch request
+GRAPH_BATCH_EDGES = {
+    'get_owned_ad_accounts': 'owned_ad_accounts',
+    'get_campaigns': 'campaigns',
+    'get_ad_sets': 'adsets',
+    'get_ads': 'ads'
+}
+LEVEL_INSIGHTS_PAGE_SIZE = 500
+DEFAULT_FACEBOOK_INSIGHTS_WINDOW = 'full'
+DEFAULT_FACEBOOK_LOOKBACK_DAYS = 28
+
+ASYNC_REPORT_POLL_INTERVAL = 2
+ASYNC_REPORT_MAX_POLL_INTERVAL = 60
+
+LEVEL_ID_FIELDS = {
+    'campaign': 'campaign_id',
+    'adset': 'adset_id',
+    'ad': 'ad_id'
+}
+
+RATE_LIMIT_ERROR_CODES = (4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80009, 80014)
+RATE_LIMIT_SLOWDOWN_USAGE = 75
+RATE_LIMIT_MAX_INTERVAL = 10
+RATE_LIMIT_FALLBACK_WAIT = 60
+RATE_LIMIT_MAX_WAIT = 3600
+
+class RateLimitScheduler:
+    # Planificador de llamadas a la Graph API por ámbito: 'app', 'business:<id>' y 'account:<id>'.
+    # Por encima de RATE_LIMIT_SLOWDOWN_USAGE espacia las llamadas de cada ámbito (hasta
+    # RATE_LIMIT_MAX_INTERVAL segundos entre llamadas cerca del 100%), y cuando la API informa un
+    # tiempo de recuperación bloquea solo ese ámbito durante exactamente ese tiempo.
+    def __init__(self, slowdown_usage=RATE_LIMIT_SLOWDOWN_USAGE, max_interval=RATE_LIMIT_MAX_INTERVAL):
+        self.slowdown_usage = slowdown_usage
+        self.max_interval = max_interval
+        self._usage = {}
+        self._blocked_until = {}
+        self._next_call = {}
+        self._account_scopes = {}
+        self._lock = threading.Lock()
+
+    def _scopes(self, account_id):
+        scopes = {'app'} | self._account_scopes.get(account_id, set())
+        if account_id:
+            scopes.add(f'account:{account_id}')
+        return scopes
+
+    def _interval(self, scope):
+        usage = self._usage.get(scope, 0)
+        if usage < self.slowdown_usage:
+            return 0
+        return self.max_interval * min(1, (usage - self.slowdown_usage) / (100 - self.slowdown_usage))
+
+    def acquire(self, account_id=None):
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                scopes = self._scopes(account_id)
+                start = max([now] + [self._blocked_until.get(scope, 0) for scope in scopes] + [self._next_call.get(scope, 0) for scope in scopes])
+                if start <= now:
+                    for scope in scopes:
+                        interval = self._interval(scope)
+                        if interval:
+                            self._next_call[scope] = now + interval
+                    if waited:
+                        metrics.run_metrics.record_sleep('rate_limit', waited)
+                    return waited
+            time.sleep(start - now)
+            waited += start - now
+
+    def update(self, account_id, headers):
+        usage = parse_usage_headers(headers)
+        with self._lock:
+            now = time.monotonic()
+            if usage['app'] is not None:
+                self._usage['app'] = usage['app']
+            if usage['account'] is not None and account_id:
+                self._usage[f'account:{account_id}'] = usage['account']
+                if usage['account_regain']:
+                    self._block(f'account:{account_id}', now + usage['account_regain'])
+            for key, (business_usage, regain) in usage['business'].items():
+                scope = f'business:{key}'
+                self._account_scopes.setdefault(account_id, set()).add(scope)
+                self._usage[scope] = business_usage
+                if regain:
+                    self._block(scope, now + regain)
+            scopes = self._scopes(account_id)
+            for scope in scopes:
+                if scope in self._usage:
+                    metrics.run_metrics.record_usage(scope, self._usage[scope])
+            return max([0] + [self._usage.get(scope, 0) for scope in scopes])
+
+    def throttled(self, account_id, headers, attempt=0, app_wide=False):
+        # Error de límite: si la API no dijo cuánto esperar se bloquea el ámbito con un backoff exponencial
+        usage = self.update(account_id, headers)
+        with self._lock:
+            now = time.monotonic()
+            scopes = self._scopes(account_id)
+            if not any(self._blocked_until.get(scope, 0) > now for scope in scopes):
+                scope = f'account:{account_id}' if account_id and not app_wide else 'app'
+                self._block(scope, now + RATE_LIMIT_FALLBACK_WAIT * (2 ** attempt))
+        return max(usage, 100)
+
+    def _block(self, scope, until):
+        until = min(until, time.monotonic() + RATE_LIMIT_MAX_WAIT)
+        self._blocked_until[scope] = max(self._blocked_until.get(scope, 0), until)
+        # Pasado el bloqueo la cuota está recuperada: se retoma sin espaciar hasta la siguiente respuesta
+        self._usage[scope] = 0
+        logging.warning(f"Rate limit: {scope} en pausa {until - time.monotonic():.0f}s")
+
+class UsageLimiter:
+    # Limita las llamadas concurrentes de una cuenta según el último porcentaje de uso
+    # informado por la API (el máximo entre cuenta, business y app que calcula check_limit).
+    def __init__(self, max_concurrency, account_id=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.account_id = account_id
+        self.usage = 0
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def allowed_concurrency(self):
+        if self.usage >= 90:
+            return 1
+        if self.usage >= 75:
+            return max(1, self.max_concurrency // 4)
+        if self.usage >= 50:
+            return max(1, self.max_concurrency // 2)
+        return self.max_concurrency
+
+    def update(self, usage):
+        with self._condition:
+            self.usage = usage
+            self._condition.notify_all()
+
+    def __enter__(self):
+        with self._condition:
+            while self._active >= self.allowed_concurrency():
+                self._condition.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+def group_by_parent(items, parent_key):
+    groups = {}
+    for item in items:
+        groups.setdefault(item[parent_key], []).append(item)
+    return groups
+
+def fetch_data_from_facebook_api(effective_status=['ACTIVE'], max_accounts=None, account_workers=None, insights_mode=None, flat=False, insights_window=None, watermarks=None, lookback_days=None, stream=False, cache=None, skip_ad_accounts=None, batch_requests=None, structure_mode=None, only_ad_accounts=None, list_only=False, rollups=None):
+    app_id = os.environ["FACEBOOK_APP_ID"]
+    app_secret = os.environ["FACEBOOK_APP_SECRET"]
+    access_token = os.environ["FACEBOOK_ACCESS_TOKEN"]
+    business_id = os.environ["FACEBOOK_BUSINESS_ID"]
+
+    account_workers = account_workers or int(os.environ.get('FACEBOOK_ACCOUNT_WORKERS', DEFAULT_FACEBOOK_ACCOUNT_WORKERS))
+    max_accounts = max_accounts or int(os.environ.get('FACEBOOK_MAX_ACCOUNTS', DEFAULT_FACEBOOK_MAX_ACCOUNTS))
+
+    # FACEBOOK_GRAPH_URL permite apuntar a otro servidor (por ejemplo el falso de benchmarks/)
+    graph_url = os.environ.get('FACEBOOK_GRAPH_URL', FACEBOOK_GRAPH_URL).rstrip('/')
+
+    # Sin FacebookAdsApi.init: esa API por defecto es global y la reemplazaría cada worker del mismo
+    # proceso. Los objetos raíz reciben api= y los que se piden a partir de ellos heredan la suya.
+    api = FacebookAdsApi(FacebookSession(app_id, app_secret, access_token, timeout=HTTP_TIMEOUT))
+    api._session.GRAPH = graph_url
+    # Todas las llamadas del SDK (y las de check_limit) usan la sesión del SDK con el pool configurado
+    session = configure_http_session(api._session.requests, pool_size=max_accounts * account_workers)
+    expand_api = FacebookAdsApi(FacebookSession(app_id, app_secret, access_token, timeout=HTTP_TIMEOUT))
+    expand_api._session.GRAPH = graph_url
+    configure_http_session(expand_api._session.requests, pool_size=max_accounts, retry_statuses=EXPAND_RETRY_STATUSES)
+    scheduler = RateLimitScheduler()
+    limiters = {}
+    limiters_lock = threading.Lock()
+
+    status_map = {
+        1: 'ACTIVE',
+        2: 'DISABLED',
+        3: 'UNSETTLED',
+        7: 'PENDING_RISK_REVIEW',
+        8: 'PENDING_SETTLEMENT',
+        9: 'IN_GRACE_PERIOD',
+        100: 'PENDING_CLOSURE',
+        101: 'CLOSED',
+        201: 'ANY_ACTIVE',
+        202: 'ANY_CLOSED'
+    }
+
+    def check_limit(response, use_response=True, account_number=None):
+        if not use_response:
+            response = session.get(f'{graph_url}/{FACEBOOK_GRAPH_VERSION}/act_{account_number}/insights', params={'access_token': access_token}, timeout=HTTP_TIMEOUT)
+        
+        headers = response._headers if hasattr(response, '_headers') else response.headers if not use_response else getattr(response, '_http_headers', {})
+
+        # El planificador guarda el uso y los tiempos de recuperación por app, business y cuenta
+        return scheduler.update(account_number, headers)
+
+    def api_call_with_retries(func, *args, limiter=None, **kwargs):
+        max_retries = 5
+        account_id = limiter.account_id if limiter else None
+        for attempt in range(max_retries):
+            scheduler.acquire(account_id)
+            try:
+                if limiter:
+                    with limiter:
+                        response = func(*args, **kwargs)
+                else:
+                    response = func(*args, **kwargs)
+            except FacebookRequestError as e:
+                if e.api_error_code() in RATE_LIMIT_ERROR_CODES:
+                    # Solo se frena el ámbito afectado; las demás cuentas siguen
+                    usage = scheduler.throttled(account_id, e.http_headers() or {}, attempt, app_wide=e.api_error_code() == 4)
+                    if limiter:
+                        limiter.update(usage)
+                    continue
+                raise
+            usage = check_limit(response, account_number=account_id)
+            if limiter:
+                limiter.update(usage)
+            return response
+        raise Exception("Max retries exceeded")
+
+    def load_next_page(cursor):
+        cursor.load_next_page()
+        return cursor
+
+    def iterate_with_retries(cursor, limiter=None):
+        # Recorre todas las páginas de un Cursor pasando cada página por los reintentos
+        while len(cursor):
+            while len(cursor):
+                yield next(cursor)
+            api_call_with_retries(load_next_page, cursor, limiter=limiter)
+
+    def batch_relative_url(node_id, edge, params):
+        query = {key: value if isinstance(value, str) else json.dumps(value) for key, value in params.items()}
+        return f"{node_id}/{edge}?{urlencode(query)}"
+
+    def batch_get(requests_params, limiter=None, pool=None):
+        # Pide varios (nodo, edge, params) en batch requests de hasta GRAPH_BATCH_SIZE llamadas,
+        # varios batches a la vez en el pool. Cada llamada sigue su cursor en la siguiente ronda y
+        # solo vuelven a la cola las que fallaron o fueron limitadas. Devuelve las filas de cada
+        # pedido en el mismo orden.
+        account_id = limiter.account_id if limiter else None
+        results = [[] for _ in requests_params]
+
+        def run_batch(calls):
+            batch = [{'method': 'GET', 'relative_url': batch_relative_url(node_id, edge, params)} for _, node_id, edge, params, _ in calls]
+            response = api_call_with_retries(api.call, 'POST', (), params={'batch': batch}, limiter=limiter)
+            requeued = []
+            for position, (call, call_response) in enumerate(zip(calls, response.json())):
+                index, node_id, edge, params, attempt = call
+                if not call_response:
+                    # La API no llegó a responder esta llamada dentro del batch
+                    if attempt + 1 >= HTTP_MAX_RETRIES:
+                        raise Exception(f"Batch request for {node_id}/{edge} got no response after {HTTP_MAX_RETRIES} attempts")
+                    requeued.append((index, node_id, edge, params, attempt + 1))
+                    continue
+                headers = {header['name'].lower(): header['value'] for header in call_response.get('headers') or []}
+                body = json.loads(call_response.get('body') or '{}')
+                if call_response.get('code') == 200:
+                    usage = scheduler.update(account_id, headers)
+                    if limiter:
+                        limiter.update(usage)
+                    results[index].extend(body.get('data', []))
+                    paging = body.get('paging', {})
+                    if 'next' in paging and paging.get('cursors', {}).get('after'):
+                        requeued.append((index, node_id, edge, dict(params, after=paging['cursors']['after']), 0))
+                    continue
+                error = body.get('error', {})
+                throttled = error.get('code') in RATE_LIMIT_ERROR_CODES
+                if attempt + 1 >= HTTP_MAX_RETRIES or not (throttled or error.get('is_transient')):
+                    raise FacebookRequestError(f"Batch request for {node_id}/{edge} failed", batch[position], call_response.get('code'), headers, call_response.get('body'))
+                if throttled:
+                    # Igual que fuera de un batch: solo se frena el ámbito afectado
+                    usage = scheduler.throttled(account_id, headers, attempt, app_wide=error.get('code') == 4)
+                    if limiter:
+                        limiter.update(usage)
+                requeued.append((index, node_id, edge, params, attempt + 1))
+            return requeued
+
+        pending = [(index, node_id, edge, dict(params), 0) for index, (node_id, edge, params) in enumerate(requests_params)]
+        while pending:
+            batches = [pending[start:start + GRAPH_BATCH_SIZE] for start in range(0, len(pending), GRAPH_BATCH_SIZE)]
+            pending = [call for requeued in (pool.map(run_batch, batches) if pool else map(run_batch, batches)) for call in requeued]
+        return results
+
+    def fetch_edges(parents, edge, object_class, fields, params=None, limiter=None, pool=None):
+        # Objetos de un edge para cada padre: en batch requests si están activados, si no una llamada por padre
+        if batch_requests and len(parents) > 1:
+            edge_params = dict(params or {}, fields=','.join(fields))
+            results = batch_get([(parent['id'], GRAPH_BATCH_EDGES[edge], edge_params) for parent in parents], limiter, pool)
+            return [[object_class(data['id'], api=api)._set_data(data) for data in rows] for rows in results]
+
+        def fetch(parent):
+            return list(iterate_with_retries(api_call_with_retries(getattr(parent, edge), fields=fields, params=params, limiter=limiter), limiter))
+        return list(pool.map(fetch, parents)) if pool else [fetch(parent) for parent in parents]
+
+    def cache_key_params(params):
+        # time_range termina hoy y no cambia qué objetos lista un edge: fuera de la clave de la caché,
+        # para que las entradas no se pierdan todas a medianoche
+        return {key: value for key, value in (params or {}).items() if key != 'time_range'}
+
+    def list_edges(kind, parents, edge, object_class, fields, params=None, limiter=None, pool=None):
+        # Lista un edge (owned_ad_accounts, campaigns, adsets, ads) de varios padres pasando por la caché local.
+        # Con la entrada vencida se piden solo id y updated_time: si nada cambió se reutiliza,
+        # y solo se vuelve a descargar el edge completo de los padres que tienen objetos nuevos o modificados.
+        results = [None] * len(parents)
+        missing = list(range(len(parents)))
+        keys = [(parent['id'], edge, fields, cache_key_params(params)) for parent in parents]
+
+        if cache is not None:
+            missing, stale = [], []
+            for index, key in enumerate(keys):
+                cached, fresh = cache.get(kind, key)
+                if cached is not None and fresh:
+                    results[index] = cached
+                elif cached is not None and 'updated_time' in fields:
+                    stale.append((index, cached))
+                else:
+                    missing.append(index)
+            if stale:
+                versions = fetch_edges([parents[index] for index, _ in stale], edge, object_class, ['id', 'updated_time'], params, limiter, pool)
+                for (index, cached), objects in zip(stale, versions):
+                    if [(obj['id'], obj.get('updated_time')) for obj in objects] == [(data['id'], data.get('updated_time')) for data in cached]:
+                        cache.touch(kind, keys[index])
+                        results[index] = cached
+                    else:
+                        missing.append(index)
+            results = [[object_class(data['id'], api=api)._set_data(data) for data in cached] if cached is not None else None for cached in results]
+
+        if missing:
+            for index, objects in zip(missing, fetch_edges([parents[index] for index in missing], edge, object_class, fields, params, limiter, pool)):
+                results[index] = objects
+                if cache is not None:
+                    cache.set(kind, keys[index], [obj.export_all_data() for obj in objects])
+        return results
+
+    def list_edge(kind, parent, edge, object_class, fields, params=None, limiter=None):
+        return list_edges(kind, [parent], edge, object_class, fields, params, limiter)[0]
+
+    def get_time_range(init_date):
+        return {
+            'since': init_date,
+            'until': datetime.now().strftime('%Y-%m-%d')
+        }
+
+    insights_fields = ['spend', 'clicks', 'unique_clicks', 'cpc', 'ctr', 'impressions', 'reach']
+    campaign_fields = ['id', 'name', 'objective', 'status', 'created_time', 'updated_time', 'start_time', 'stop_time', 'daily_budget', 'lifetime_budget']
+    ad_set_fields = [
+        'id', 'campaign_id', 'name', 'status', 'created_time', 'updated_time', 'start_time', 'stop_time',
+        'daily_budget', 'lifetime_budget', 'bid_amount', 'bid_strategy', 'billing_event',
+        'optimization_goal', 'targeting'
+    ]
+    ad_fields = ['id', 'adset_id', 'name', 'status', 'created_time', 'updated_time']
+
+    def get_insights_params(init_date):
+        return {
+            'location': {'breakdowns': ['region', 'country'], 'time_range': get_time_range(init_date)},
+            'audience': {'breakdowns': ['age', 'gender'], 'time_range': get_time_range(init_date)}
+        }
+
+    def export_with_insights(obj, init_date, add_insights=False, limiter=None):
+        obj_data = obj.export_all_data()
+        if add_insights:
+            for key, value in get_insights_params(init_date).items():
+                insights = api_call_with_retries(obj.get_insights, fields=insights_fields, params=value, limiter=limiter)
+                if insights:
+                    obj_data[f'insights_{key}'] = [parse_insight(insight, key) for insight in iterate_with_retries(insights, limiter)]
+        return obj_data
+
+    def export_all_with_insights(objs, init_date, add_insights=False, pool=None, limiter=None):
+        # Con batch requests los get_insights de todos los objetos (uno por desglose) van juntos
+        if not (batch_requests and add_insights and len(objs) > 1):
+            return list(pool.map(lambda obj: export_with_insights(obj, init_date, add_insights, limiter), objs))
+        insights_params = get_insights_params(init_date)
+        results = iter(batch_get([
+            (obj['id'], 'insights', dict(value, fields=','.join(insights_fields)))
+            for obj in objs
+            for value in insights_params.values()
+        ], limiter, pool))
+        objs_data = []
+        for obj in objs:
+            obj_data = obj.export_all_data()
+            for key in insights_params:
+                insights = next(results)
+                if insights:
+                    obj_data[f'insights_{key}'] = [parse_insight(insight, key) for insight in insights]
+            objs_data.append(obj_data)
+        return objs_data
+
+    def get_level_insights_params(level, time_range, daily=False):
+        level_params = {}
+        for key, value in get_insights_params(init_date).items():
+            params = dict(
+                value,
+                level=level,
+                time_range=time_range,
+                filtering=[{'field': 'campaign.effective_status', 'operator': 'IN', 'value': effective_status}],
+                limit=LEVEL_INSIGHTS_PAGE_SIZE
+            )
+            if daily:
+                params['time_increment'] = 1
+                key = f'daily_{key}'
+            level_params[key] = params
+        return level_params
+
+    def get_level_queries(levels, time_range, daily=False):
+        queries = []
+        for level, objects_info in levels:
+            objects_by_id = {obj['id']: obj for obj in objects_info}
+            for key, params in get_level_insights_params(level, time_range, daily).items():
+                queries.append((level, key, params, objects_by_id))
+        return queries
+
+    def join_level_insights(insights, key, id_field, objects_by_id, limiter=None):
+        for insight in iterate_with_retries(insights, limiter):
+            obj_data = objects_by_id.get(insight.get(id_field))
+            if obj_data is not None:
+                obj_data.setdefault(f'insights_{key}', []).append(parse_insight(insight, key))
+
+    def run_level_query(ad_account, query, limiter=None):
+        # Una consulta por cuenta y desglose con level=campaign|adset|ad en lugar de una por objeto;
+        # las filas se unen a cada objeto por su id.
+        level, key, params, objects_by_id = query
+        id_field = LEVEL_ID_FIELDS[level]
+        insights = api_call_with_retries(ad_account.get_insights, fields=insights_fields + [id_field], params=params, limiter=limiter)
+        join_level_insights(insights, key, id_field, objects_by_id, limiter)
+
+    def run_async_level_queries(ad_account, queries, pool, limiter=None):
+        # Lanza todas las consultas de la cuenta como AdReportRun para que corran en paralelo
+        # del lado de Facebook, y las consulta juntas con un intervalo creciente.
+        jobs = []
+        for level, key, params, objects_by_id in queries:
+            id_field = LEVEL_ID_FIELDS[level]
+            report = api_call_with_retries(ad_account.get_insights, fields=insights_fields + [id_field], params=params, is_async=True, limiter=limiter)
+            jobs.append((report, key, id_field, objects_by_id))
+
+        def poll(job):
+            return api_call_with_retries(job[0].api_get, fields=[AdReportRun.Field.async_status, AdReportRun.Field.async_percent_completion], limiter=limiter)
+
+        def collect(job):
+            report, key, id_field, objects_by_id = job
+            insights = api_call_with_retries(report.get_result, params={'limit': LEVEL_INSIGHTS_PAGE_SIZE}, limiter=limiter)
+            join_level_insights(insights, key, id_field, objects_by_id, limiter)
+
+        poll_interval = ASYNC_REPORT_POLL_INTERVAL
+        pending = jobs
+        while pending:
+            time.sleep(poll_interval)
+            metrics.run_metrics.record_sleep('async_report_poll', poll_interval)
+            completed, running = [], []
+            for job, report in zip(pending, pool.map(poll, pending)):
+                status = report[AdReportRun.Field.async_status]
+                if status == 'Job Completed' and report[AdReportRun.Field.async_percent_completion] == 100:
+                    completed.append(job)
+                elif status in ('Job Failed', 'Job Skipped'):
+                    raise Exception(f"Async insights report {report['id']} ended with status: {status}")
+                else:
+                    running.append(job)
+            # Los reportes terminados se descargan mientras los demás siguen corriendo
+            list(pool.map(collect, completed))
+            pending = running
+            poll_interval = min(poll_interval * 2, ASYNC_REPORT_MAX_POLL_INTERVAL)
+
+    def get_daily_time_range(ad_account_id):
+        # Desde la última fecha sincronizada menos la ventana de atribución, o desde init_date
+        # si la cuenta todavía no tiene marca de sincronización.
+        synced = [watermarks.get((level, ad_account_id)) for level in DAILY_INSIGHTS_LEVELS]
+        since = init_date
+        if all(synced):
+            since = (datetime.strptime(min(synced), '%Y-%m-%d') - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+            since = max(since, init_date)
+        return {
+            'since': since,
+            'until': datetime.now().strftime('%Y-%m-%d')
+        }
+
+    def get_ad_accounts(business_id):
+        business = Business(business_id, api=api)
+        
+        fields = ['id', 'name', 'currency', 'timezone_name', 'created_time']
+
+        ad_accounts = list_edge('ad_accounts', business, 'get_owned_ad_accounts', AdAccount, fields)
+        # Las cuentas ya cargadas en una corrida que se retoma no se vuelven a pedir;
+        # un worker (only_ad_accounts) pide solo la suya
+        return [
+            ad_account for ad_account in ad_accounts
+            if ad_account['id'] not in skip_ad_accounts and (only_ad_accounts is None or ad_account['id'] in only_ad_accounts)
+        ]
+
+    @timed_stage('facebook.ad_accounts')
+    def get_ad_accounts_with_insights(business_id, init_date, add_insights=False, pool=None):
+        ad_accounts = get_ad_accounts(business_id)
+        ad_accounts_info = list(pool.map(lambda ad_account: export_with_insights(ad_account, init_date, add_insights, get_limiter(ad_account['id'])), ad_accounts))
+
+        return ad_accounts, ad_accounts_info
+
+    def get_campaigns_params(init_date, effective_status):
+        return {
+            'effective_status': effective_status,
+            'time_range': get_time_range(init_date),
+            'level': 'campaign'
+        }
+
+    def expansion_fields(levels):
+        # Campos del primer nivel con los siguientes anidados: id,...,adsets.limit(100){id,...,ads.limit(100){...}}
+        fields = levels[0][1]
+        if len(levels) == 1:
+            return fields
+        return fields + [f"{levels[1][0]}.limit({EXPAND_NESTED_PAGE_SIZE}){{{','.join(expansion_fields(levels[1:]))}}}"]
+
+    def fetch_expanded(node_id, levels, params=None, limiter=None):
+        # Se lee el JSON crudo: el parser del SDK convierte campaigns/adsets/ads anidados en listas
+        # de objetos y descarta su paging, que hace falta para pedir el resto de cada página anidada
+        params = dict(params or {}, fields=','.join(expansion_fields(levels)))
+        items = []
+        while True:
+            body = api_call_with_retries(expand_api.call, 'GET', (node_id, levels[0][0]), params=params, limiter=limiter).json()
+            items.extend(body.get('data', []))
+            paging = body.get('paging', {})
+            if 'next' not in paging:
+                break
+            params = dict(params, after=paging['cursors']['after'])
+        return expand_children(items, levels, limiter)
+
+    def expand_children(items, levels, limiter=None):
+        # Reemplaza el edge anidado de cada objeto ({'data': [...], 'paging': {...}}) por la lista completa.
+        # Si la página anidada quedó incompleta, el resto se pide al edge de ese padre con la misma expansión.
+        if len(levels) == 1:
+            return items
+        child_edge = levels[1][0]
+        for item in items:
+            nested = item.pop(child_edge, None) or {}
+            children = expand_children(nested.get('data', []), levels[1:], limiter)
+            paging = nested.get('paging', {})
+            if 'next' in paging:
+                children += fetch_expanded(item['id'], levels[1:], {'after': paging['cursors']['after'], 'limit': EXPAND_NESTED_PAGE_SIZE}, limiter)
+            item[child_edge] = children
+        return items
+
+    def get_account_structure(ad_account, init_date, effective_status=['ACTIVE'], limiter=None):
+        # Campañas, ad sets y ads de la cuenta en una sola consulta paginada con expansión de campos
+        # (campaigns{...,adsets{...,ads{...}}}) en lugar de un get_ad_sets por campaña y un get_ads por ad set
+        levels = [
+            ('campaigns', campaign_fields),
+            ('adsets', ad_set_fields),
+            ('ads', ad_fields)
+        ]
+        params = dict(get_campaigns_params(init_date, effective_status), limit=EXPAND_PAGE_SIZE)
+        fetch = lambda: fetch_expanded(ad_account['id'], levels, params, limiter)
+        tree = cache.get_or_fetch('campaigns', (ad_account['id'], 'expand', expansion_fields(levels), cache_key_params(params)), fetch) if cache else fetch()
+
+        campaigns, ad_sets, ads = [], [], []
+        for campaign_data in tree:
+            campaign_data = dict(campaign_data)
+            for ad_set_data in campaign_data.pop('adsets', []):
+                ad_set_data = dict(ad_set_data)
+                ads.extend(Ad(ad_data['id'], api=api)._set_data(ad_data) for ad_data in ad_set_data.pop('ads', []))
+                ad_sets.append(AdSet(ad_set_data['id'], api=api)._set_data(ad_set_data))
+            campaigns.append(Campaign(campaign_data['id'], api=api)._set_data(campaign_data))
+        return campaigns, ad_sets, ads
+
+    def get_campaigns_with_insights(ad_account, init_date, effective_status=['ACTIVE'], add_insights=False, pool=None, limiter=None, campaigns=None):
+        if campaigns is None:
+            campaigns = list_edge('campaigns', ad_account, 'get_campaigns', Campaign, campaign_fields, get_campaigns_params(init_date, effective_status), limiter)
+        campaigns_info = export_all_with_insights(campaigns, init_date, add_insights, pool, limiter)
+
+        return campaigns, campaigns_info
+
+    def get_ad_sets_with_insights(campaigns, init_date, add_insights=False, pool=None, limiter=None, ad_sets=None):
+        params = {
+            'time_range': get_time_range(init_date),
+            'level': 'adset'
+        }
+
+        all_ad_sets = ad_sets
+        if all_ad_sets is None:
+            campaigns_ad_sets = list_edges('ad_sets', campaigns, 'get_ad_sets', AdSet, ad_set_fields, params, limiter, pool)
+            all_ad_sets = [ad_set for ad_sets in campaigns_ad_sets for ad_set in ad_sets]
+        ad_sets_info = export_all_with_insights(all_ad_sets, init_date, add_insights, pool, limiter)
+
+        return all_ad_sets, ad_sets_info
+
+    def get_ads_with_insights(ad_sets, init_date, add_insights=False, pool=None, limiter=None, ads=None):
+        params = {
+            'time_range': get_time_range(init_date),
+            'level': 'ad'
+        }
+
+        all_ads = ads
+        if all_ads is None:
+            ad_sets_ads = list_edges('ads', ad_sets, 'get_ads', Ad, ad_fields, params, limiter, pool)
+            all_ads = [ad for ads in ad_sets_ads for ad in ads]
+        ads_info = export_all_with_insights(all_ads, init_date, add_insights, pool, limiter)
+        
+        return ads_info
+
+    def get_limiter(account_id):
+        with limiters_lock:
+            if account_id not in limiters:
+                limiters[account_id] = UsageLimiter(account_workers, account_id)
+            return limiters[account_id]
+
+    @timed_stage('facebook.ad_account')
+    def fetch_ad_account_tree(ad_account, ad_account_info):
+        # Cada cuenta tiene su propio pool y limitador: el uso de una cuenta no frena a las demás
+        limiter = get_limiter(ad_account_info['id'])
+        per_object_insights = insights_mode == 'object'
+        daily = insights_window == 'daily'
+        campaigns = ad_sets = ads = None
+        if structure_mode == 'expand':
+            try:
+                campaigns, ad_sets, ads = get_account_structure(ad_account, init_date, effective_status, limiter)
+            except FacebookRequestError as e:
+                if e.api_error_code() != GRAPH_DATA_TOO_LARGE_ERROR_CODE:
+                    raise
+                logging.warning(f"Ad account {ad_account_info['id']}: expanded structure too large, falling back to per-level requests")
+        with ContextThreadPoolExecutor(max_workers=account_workers) as pool:
+            ad_account_campaigns, ad_account_campaigns_info = get_campaigns_with_insights(ad_account, init_date, effective_status, add_insights=per_object_insights and parent_insights, pool=pool, limiter=limiter, campaigns=campaigns)
+            ad_account_ad_sets, ad_account_ad_sets_info = get_ad_sets_with_insights(ad_account_campaigns, init_date, add_insights=per_object_insights and not daily, pool=pool, limiter=limiter, ad_sets=ad_sets)
+            ad_account_ads_info = get_ads_with_insights(ad_account_ad_sets, init_date, add_insights=per_object_insights and not daily, pool=pool, limiter=limiter, ads=ads)
+
+            levels = [('campaign', ad_account_campaigns_info)] if parent_insights else []
+            breakdown_levels = [
+                ('adset', ad_account_ad_sets_info),
+                ('ad', ad_account_ads_info)
+            ]
+            queries = []
+            if not per_object_insights:
+                queries += get_level_queries(levels if daily else levels + breakdown_levels, get_time_range(init_date))
+            if daily:
+                # Ad sets y ads solo piden la ventana reciente, día por día
+                daily_range = get_daily_time_range(ad_account_info['id'])
+                queries += get_level_queries(breakdown_levels, daily_range, daily=True)
+                ad_account_info['daily_insights_range'] = daily_range
+            if not parent_insights:
+                # create_facebook_rows arma las tablas de cuentas y campañas sin métricas solo para estas cuentas
+                ad_account_info['insight_rollups'] = True
+
+            if insights_mode == 'async':
+                run_async_level_queries(ad_account, queries, pool, limiter)
+            else:
+                list(pool.map(lambda query: run_level_query(ad_account, query, limiter), queries))
+
+        logging.info(f"Processed ad account: {ad_account_info.get('name')}")
+        if flat:
+            return index_ad_account(ad_account_info, ad_account_campaigns_info, ad_account_ad_sets_info, ad_account_ads_info)
+
+        ad_sets_by_campaign = group_by_parent(ad_account_ad_sets_info, 'campaign_id')
+        ads_by_ad_set = group_by_parent(ad_account_ads_info, 'adset_id')
+        for ad_campaign in ad_account_campaigns_info:
+            ad_sets = ad_sets_by_campaign.get(ad_campaign['id'], [])
+            for ad_set in ad_sets:
+                ad_set.update({'ads': ads_by_ad_set.get(ad_set['id'], [])})
+            ad_campaign.update({'ad_sets': ad_sets})
+        ad_account_info.update({'campaigns': ad_account_campaigns_info})
+        return ad_account_info
+
+    init_date = '2024-01-01'
+    insights_mode = insights_mode or os.environ.get('FACEBOOK_INSIGHTS_MODE', DEFAULT_FACEBOOK_INSIGHTS_MODE)
+    if insights_mode not in ('object', 'level', 'async'):
+        raise ValueError(f"Unknown insights mode: {insights_mode}")
+    insights_window = insights_window or os.environ.get('FACEBOOK_INSIGHTS_WINDOW', DEFAULT_FACEBOOK_INSIGHTS_WINDOW)
+    if insights_window not in ('full', 'daily'):
+        raise ValueError(f"Unknown insights window: {insights_window}")
+    # Las marcas de sync_watermarks las lee quien llama (get_sync_watermarks), que es quien tiene la
+    # conexión a la base; sin marcas, la ventana diaria pide día por día todo el historial desde init_date
+    watermarks = watermarks or {}
+    lookback_days = lookback_days or int(os.environ.get('FACEBOOK_LOOKBACK_DAYS', DEFAULT_FACEBOOK_LOOKBACK_DAYS))
+    cache = cache or get_response_cache()
+    skip_ad_accounts = set(skip_ad_accounts or ())
+    only_ad_accounts = set(only_ad_accounts) if only_ad_accounts is not None else None
+    if batch_requests is None:
+        batch_requests = os.environ.get('FACEBOOK_BATCH_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+    structure_mode = structure_mode or os.environ.get('FACEBOOK_STRUCTURE_MODE', DEFAULT_FACEBOOK_STRUCTURE_MODE)
+    if structure_mode not in ('edges', 'expand'):
+        raise ValueError(f"Unknown structure mode: {structure_mode}")
+    if rollups is None:
+        rollups = os.environ.get('INSIGHT_ROLLUPS', 'false').lower() in ('1', 'true', 'yes')
+    # Los totales de cuentas y campañas se calculan en la base a partir de las filas de ad sets (ver
+    # INSIGHT_ROLLUPS en rows), así que no se piden sus insights. La ventana diaria no carga las
+    # filas acumuladas de ad sets y sigue necesitándolos.
+    parent_insights = not (rollups and insights_window == 'full')
+
+    # list_only: solo la lista de cuentas, para que el coordinador reparta el trabajo
+    if list_only:
+        return [ad_account.export_all_data() for ad_account in get_ad_accounts(business_id)]
+
+    def iter_ad_account_trees():
+        with ContextThreadPoolExecutor(max_workers=max_accounts) as accounts_pool:
+            ad_accounts, ad_accounts_info = get_ad_accounts_with_insights(business_id, init_date, add_insights=parent_insights, pool=accounts_pool)
+            # En modo stream cada cuenta se entrega apenas está lista y no se buscan más
+            # cuentas de las que el consumidor alcanza a procesar
+            yield from bounded_map(accounts_pool, lambda args: fetch_ad_account_tree(*args), zip(ad_accounts, ad_accounts_info), max_accounts if stream else None)
+
+    if stream:
+        return iter_ad_account_trees()
+    return list(iter_ad_account_trees())
@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+from datetime import datetime, timezone
+from .db import create_db_connection, get_sync_watermarks, stream_db_data
+from .metrics import timed_stage
+from .rows import iter_db_row_units
+
+# Reparto del trabajo entre varias ejecuciones de la función: el coordinador (timer) encola un
+# mensaje por publicación de Beehiiv y por cuenta publicitaria de Facebook, y cada mensaje lo
+# procesa un worker (queue trigger) que descarga y carga solo esa unidad.
+SYNC_SOURCES = ('beehiiv', 'facebook')
+DEFAULT_SYNC_SOURCES = 'beehiiv'
+
+def get_sync_sources(sources=None):
+    if sources is None:
+        sources = [source.strip() for source in os.environ.get('SYNC_SOURCES', DEFAULT_SYNC_SOURCES).split(',') if source.strip()]
+    unknown = [source for source in sources if source not in SYNC_SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown sync sources: {', '.join(unknown)}")
+    return sources
+
+@timed_stage('fanout.list_units')
+def list_sync_units(sources=None):
+    # Cada fuente se importa solo si está en SYNC_SOURCES: el coordinador de Beehiiv no carga facebook_business
+    units = []
+    for source in get_sync_sources(sources):
+        if source == 'beehiiv':
+            from .beehiiv import fetch_data_from_beehiiv_api
+            units.extend({'source': source, 'unit_id': pub['id'], 'name': pub['name']} for pub in fetch_data_from_beehiiv_api(list_only=True))
+        else:
+            from .facebook import fetch_data_from_facebook_api
+            units.extend({'source': source, 'unit_id': ad_account['id'], 'name': ad_account['name']} for ad_account in fetch_data_from_facebook_api(list_only=True))
+    logging.info(f"Unidades a sincronizar: {len(units)}")
+    return units
+
+def create_work_items(units):
+    # Mensajes JSON para la cola (binding de salida de Azure Storage Queue o una cola en el proceso)
+    enqueued_at = datetime.now(timezone.utc).isoformat()
+    return [json.dumps(dict(unit, enqueued_at=enqueued_at)) for unit in units]
+
+def sync_unit(item, method=None, batch_size=None):
+    # Worker: descarga una sola unidad y la carga con upsert. delete_missing se limita a las filas de
+    # esa unidad, así varios workers pueden cargar a la vez sin pisarse. Un mensaje que falla vuelve
+    # a la cola (y después de varios intentos pasa a la cola -poison), por eso no se usan checkpoints.
+    if isinstance(item, str):
+        item = json.loads(item)
+    source, unit_id = item['source'], item['unit_id']
+    if source not in SYNC_SOURCES:
+        raise ValueError(f"Unknown sync source: {source}")
+
+    # La conexión se abre antes de descargar: la ventana diaria de Facebook parte de sync_watermarks
+    connection, cursor = create_db_connection()
+    beehiiv_units, facebook_units = (), ()
+    if source == 'beehiiv':
+        from .beehiiv import fetch_data_from_beehiiv_api
+        beehiiv_units = fetch_data_from_beehiiv_api(stream=True, only_publications=[unit_id])
+    else:
+        from .facebook import fetch_data_from_facebook_api
+        try:
+            watermarks = get_sync_watermarks(connection, cursor)
+        except Exception:
+            cursor.close()
+            connection.close()
+            raise
+        facebook_units = fetch_data_from_facebook_api(stream=True, only_ad_accounts=[unit_id], watermarks=watermarks)
+
+    logging.info(f"Sincronizando {source} {unit_id}")
+    row_units = iter_db_row_units(beehiiv_units, facebook_units, sync_modes='upsert', delete_missing=True, scoped=True)
+    stream_db_data(connection, cursor, row_units, method, batch_size)
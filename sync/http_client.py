@@ -0,0 +1,123 @@
+import re
+import json
+import time
+import requests
+from collections import deque
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from . import metrics
+
+HTTP_TIMEOUT = 60
+HTTP_MAX_RETRIES = 5
+HTTP_BACKOFF_FACTOR = 1
+HTTP_MAX_RETRY_WAIT = 300
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def parse_usage_headers(headers):
+    # Uso (%) y segundos hasta recuperar acceso según los encabezados de uso de la Graph API.
+    # None significa que el encabezado no vino en la respuesta.
+    usage = {'app': None, 'account': None, 'account_regain': 0, 'business': {}}
+
+    if 'x-ad-account-usage' in headers:
+        ad_account_usage_data = json.loads(headers['x-ad-account-usage'])
+        usage['account'] = float(ad_account_usage_data.get('acc_id_util_pct', 0))
+        if usage['account'] >= 100:
+            usage['account_regain'] = float(ad_account_usage_data.get('reset_time_duration', 0))
+
+    if 'x-business-use-case-usage' in headers:
+        business_usage_data = json.loads(headers['x-business-use-case-usage'])
+        for key, value in business_usage_data.items():
+            business_usage, regain = 0, 0
+            for account_usage in value:
+                business_usage = max(
+                    business_usage,
+                    float(account_usage.get('call_count', 0)),
+                    float(account_usage.get('total_cputime', 0)),
+                    float(account_usage.get('total_time', 0))
+                )
+                regain = max(regain, float(account_usage.get('estimated_time_to_regain_access', 0)) * 60)
+            usage['business'][key] = (business_usage, regain)
+
+    if 'x-fb-ads-insights-throttle' in headers:
+        insights_throttle_data = json.loads(headers['x-fb-ads-insights-throttle'])
+        usage['app'] = float(insights_throttle_data.get('app_id_util_pct', 0))
+        usage['account'] = max(usage['account'] or 0, float(insights_throttle_data.get('acc_id_util_pct', 0)))
+
+    if 'x-app-usage' in headers:
+        app_usage_data = json.loads(headers['x-app-usage'])
+        usage['app'] = max(
+            usage['app'] or 0,
+            float(app_usage_data.get('call_count', 0)),
+            float(app_usage_data.get('total_cputime', 0)),
+            float(app_usage_data.get('total_time', 0))
+        )
+
+    return usage
+
+def usage_wait_seconds(headers):
+    # Tiempo de espera que piden los encabezados de uso de Facebook cuando se alcanzó el límite
+    usage = parse_usage_headers(headers)
+    return max([usage['account_regain']] + [regain for _, regain in usage['business'].values()])
+
+class UsageAwareRetry(Retry):
+    # Respeta Retry-After y, si no viene, el tiempo de recuperación de los encabezados de uso
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            try:
+                retry_after = usage_wait_seconds(response.headers) or None
+            except (ValueError, TypeError, AttributeError):
+                retry_after = None
+        return min(retry_after, HTTP_MAX_RETRY_WAIT) if retry_after is not None else None
+
+    def sleep(self, response=None):
+        started = time.perf_counter()
+        super().sleep(response)
+        metrics.run_metrics.record_sleep('http_retry', time.perf_counter() - started)
+
+def configure_http_session(session, pool_size, headers=None, retry_statuses=HTTP_RETRY_STATUSES):
+    # Pool de conexiones keep-alive del tamaño de la concurrencia, gzip y una sola política de reintentos
+    retry = UsageAwareRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=retry_statuses,
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    if headers:
+        session.headers.update(headers)
+    session.hooks['response'].append(record_http_response)
+    return session
+
+def create_http_session(pool_size, headers=None):
+    return configure_http_session(requests.Session(), pool_size, headers)
+
+_ENDPOINT_ID = re.compile(r'^(act_)?[^/]*\d[^/]*$')
+
+def _endpoint_name(method, url):
+    # /v20.0/act_123/insights -> GET /act_{id}/insights; /v2/publications/pub_x/posts -> GET /publications/{id}/posts
+    path = [segment for segment in requests.utils.urlparse(url).path.split('/') if segment]
+    if path and re.match(r'^v\d+(\.\d+)?$', path[0]):
+        path = path[1:]
+    return f"{method} /" + '/'.join(re.sub(_ENDPOINT_ID, lambda match: f"{match.group(1) or ''}{{id}}", segment) for segment in path)
+
+def record_http_response(response, *args, **kwargs):
+    metrics.run_metrics.record_http(_endpoint_name(response.request.method, response.url), response.status_code, len(response.content), response.elapsed.total_seconds())
+
+def bounded_map(pool, func, items, max_pending=None):
+    # Como pool.map, pero solo envía una tarea nueva cuando el consumidor retira un resultado:
+    # nunca hay más de max_pending unidades en curso o esperando, y se respeta el orden.
+    if not max_pending:
+        yield from pool.map(func, items)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(pool.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+class RunMetrics:
+    # Métricas de una corrida: tiempo por etapa, llamadas HTTP y bytes por endpoint, tiempo dormido
+    # por motivo, uso informado por la API y filas / rendimiento por tabla. Las etapas que corren en
+    # paralelo suman su tiempo, así que el total de una etapa puede superar la duración de la corrida.
+    # imports guarda lo que tardó en cargarse cada módulo de sync/ que se importó para esta corrida,
+    # acumulado por punto de entrada (ver _load en beehiiv_database).
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.http = {}
+        self.sleeps = {}
+        self.usage = {}
+        self.tables = {}
+        self.imports = {}
+        self.reported = False
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - started)
+
+    def record_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'count': 0, 'seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] += seconds
+
+    def record_http(self, endpoint, status, size, seconds):
+        with self._lock:
+            calls = self.http.setdefault(endpoint, {'calls': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0})
+            calls['calls'] += 1
+            calls['errors'] += status >= 400
+            calls['bytes'] += size
+            calls['seconds'] += seconds
+
+    def record_sleep(self, reason, seconds):
+        with self._lock:
+            self.sleeps[reason] = self.sleeps.get(reason, 0.0) + seconds
+
+    def record_usage(self, scope, usage):
+        with self._lock:
+            previous = self.usage.get(scope, {'max': 0})
+            self.usage[scope] = {'last': usage, 'max': max(previous['max'], usage)}
+
+    def record_table(self, table_name, rows, seconds):
+        with self._lock:
+            table = self.tables.setdefault(table_name, {'rows': 0, 'seconds': 0.0})
+            table['rows'] += rows
+            table['seconds'] += seconds
+
+    def record_import(self, module, seconds):
+        with self._lock:
+            self.imports[module] = seconds
+
+    def report(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'duration_seconds': round(time.perf_counter() - self._started, 3),
+                'stages': {name: dict(stage, seconds=round(stage['seconds'], 3)) for name, stage in self.stages.items()},
+                'http': {endpoint: dict(calls, seconds=round(calls['seconds'], 3)) for endpoint, calls in self.http.items()},
+                'http_calls': sum(calls['calls'] for calls in self.http.values()),
+                'http_bytes': sum(calls['bytes'] for calls in self.http.values()),
+                'imports': {module: round(seconds, 3) for module, seconds in self.imports.items()},
+                'import_seconds': round(sum(self.imports.values()), 3),
+                'sleep_seconds': {reason: round(seconds, 3) for reason, seconds in self.sleeps.items()},
+                'usage': dict(self.usage),
+                'tables': {
+                    table_name: dict(table, seconds=round(table['seconds'], 3), rows_per_second=round(table['rows'] / table['seconds']) if table['seconds'] else None)
+                    for table_name, table in self.tables.items()
+                }
+            }
+
+# El host de Azure Functions ejecuta varios mensajes de la cola a la vez en el mismo proceso: cada
+# ejecución tiene sus métricas en el contexto (contextvars) y metrics.run_metrics devuelve las de la
+# ejecución actual. Fuera de una corrida (los imports del arranque en frío) se usan las de arranque.
+_startup_metrics = RunMetrics()
+_current_run_metrics = contextvars.ContextVar('run_metrics', default=_startup_metrics)
+
+def __getattr__(name):
+    if name == 'run_metrics':
+        return _current_run_metrics.get()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    # Los hilos de un ThreadPoolExecutor no heredan el contexto de quien envía la tarea: cada tarea
+    # corre en una copia, así lo que mide queda en las métricas de la corrida que la envió
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def reset_run_metrics():
+    # Las instancias de Azure Functions se reutilizan entre ejecuciones: cada corrida empieza de cero
+    run_metrics = RunMetrics()
+    with _startup_metrics._lock:
+        # Los imports hechos al cargar la función (arranque en frío) ocurren antes de que empiece
+        # la corrida: se informan en la primera; las siguientes ya no vuelven a pagarlos
+        run_metrics.imports.update(_startup_metrics.imports)
+        _startup_metrics.imports.clear()
+    _current_run_metrics.set(run_metrics)
+    return run_metrics
+
+def emit_run_report(path=None):
+    # Una línea de log con el reporte en JSON (en Application Insights queda como traza, en el mensaje)
+    # y, si se indica SYNC_METRICS_REPORT_PATH, el mismo reporte como archivo JSON
+    run_metrics = _current_run_metrics.get()
+    report = run_metrics.report()
+    run_metrics.reported = True
+    logging.info(f"sync_metrics {json.dumps(report)}")
+    path = path or os.environ.get('SYNC_METRICS_REPORT_PATH')
+    if path:
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return report
+
+def timed_stage(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _current_run_metrics.get().stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
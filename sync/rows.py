@@ -0,0 +1,457 @@
+import os
+import json
+from datetime import datetime
+from decimal import Decimal
+from .metrics import timed_stage
+
+# Niveles con insights diarios (FACEBOOK_INSIGHTS_WINDOW=daily) y modo de carga por defecto (DB_SYNC_MODE)
+DAILY_INSIGHTS_LEVELS = ('adset', 'ad')
+DEFAULT_SYNC_MODE = 'replace'
+
+def index_ad_account(ad_account_info, campaigns_info, ad_sets_info, ads_info):
+    # Representación plana de una cuenta: cada nivel indexado por id, sin anidar
+    return {
+        'ad_account': ad_account_info,
+        'campaigns': {campaign['id']: campaign for campaign in campaigns_info},
+        'ad_sets': {ad_set['id']: ad_set for ad_set in ad_sets_info},
+        'ads': {ad['id']: ad for ad in ads_info}
+    }
+
+def index_facebook_info(facebook_info):
+    # Acepta tanto el árbol anidado como la representación plana de fetch_data_from_facebook_api(flat=True)
+    for ad_account in facebook_info:
+        if 'ad_account' in ad_account:
+            yield ad_account
+            continue
+        campaigns = ad_account.get('campaigns', [])
+        ad_sets = [ad_set for campaign in campaigns for ad_set in campaign.get('ad_sets', [])]
+        ads = [ad for ad_set in ad_sets for ad in ad_set.get('ads', [])]
+        yield index_ad_account(ad_account, campaigns, ad_sets, ads)
+
+INSIGHT_METRICS = ('spend', 'clicks', 'unique_clicks', 'impressions', 'reach', 'cpc', 'ctr')
+INSIGHT_BREAKDOWN_COLUMNS = {
+    'audience': ('age', 'gender'),
+    'location': ('region', 'country')
+}
+
+# Métricas que son conteos; las demás (spend, cpc, ctr) son importes o porcentajes con decimales
+INSIGHT_COUNT_METRICS = ('clicks', 'unique_clicks', 'impressions', 'reach')
+
+def _metric(metric, value):
+    # La Graph API devuelve las métricas como texto ("12", "3.45"); cpc/ctr (y a veces otras) no
+    # vienen cuando no hubo clics o impresiones y quedan en None
+    if value is None or value == '':
+        return None
+    if metric in INSIGHT_COUNT_METRICS:
+        return int(value)
+    return Decimal(str(value))
+
+class InsightRecord:
+    # Una fila de insights con solo lo que usan las tablas: los valores del desglose, la fecha (en los
+    # insights diarios) y las métricas en el orden de INSIGHT_METRICS, ya convertidas a número.
+    # Ocupa una fracción del dict de la respuesta y las filas se arman concatenando tuplas.
+    __slots__ = ('breakdown', 'date_start', 'metrics')
+
+    def __init__(self, breakdown, date_start, metrics):
+        self.breakdown = breakdown
+        self.date_start = date_start
+        self.metrics = metrics
+
+def parse_insight(insight, key):
+    # insight: dict de la respuesta u objeto AdsInsights del SDK; key: 'location', 'daily_audience'...
+    breakdown_columns = INSIGHT_BREAKDOWN_COLUMNS[key.rpartition('_')[2]]
+    return InsightRecord(
+        tuple(insight.get(column) for column in breakdown_columns),
+        insight.get('date_start'),
+        tuple(_metric(metric, insight.get(metric)) for metric in INSIGHT_METRICS)
+    )
+
+def _object_budget(obj):
+    if 'daily_budget' in obj:
+        return float(obj['daily_budget'])
+    if 'lifetime_budget' in obj:
+        return float(obj['lifetime_budget'])
+    return 0
+
+def summarize_insights(insights):
+    # Sumas de spend/clicks/unique_clicks/impressions/reach y promedios de cpc/ctr en una sola pasada
+    spend = clicks = unique_clicks = impressions = reach = cpc = ctr = 0
+    for insight in insights:
+        insight_spend, insight_clicks, insight_unique_clicks, insight_impressions, insight_reach, insight_cpc, insight_ctr = insight.metrics
+        spend += insight_spend or 0
+        clicks += insight_clicks or 0
+        unique_clicks += insight_unique_clicks or 0
+        impressions += insight_impressions or 0
+        reach += insight_reach or 0
+        cpc += insight_cpc or 0
+        ctr += insight_ctr or 0
+    count = len(insights)
+    return spend, clicks, unique_clicks, impressions, reach, cpc / count if count else 0, ctr / count if count else 0
+
+def create_db_rows(beehiiv_info, facebook_info=None, sync_modes=None, delete_missing=None):
+    rows = create_beehiiv_rows(beehiiv_info)
+    rows.update(create_facebook_rows(facebook_info))
+    return apply_sync_modes(rows, sync_modes, delete_missing)
+
+@timed_stage('rows.beehiiv')
+def create_beehiiv_rows(beehiiv_info):
+    rows = {
+        'newsletter_performance_table': {
+            'columns': "(post_id, publication_id, publication_name, publish_date, delivered, clicks, unique_clicks, click_rate, opens, unique_opens, open_rate, unsubscribes, spam_reports)",
+            'key': "(post_id)",
+            'rows': []
+        },
+        'url_performance_table': {
+            'columns': "(post_id, publication_id, url, url_clicks, url_unique_clicks, url_click_through_rate)",
+            'key': "(post_id, url)",
+            'rows': []
+        },
+        'unified_performance_table': {
+            'columns': "(post_id, publication_id, publication_name, publish_date, delivered, clicks, unique_clicks, click_rate, opens, unique_opens, open_rate, unsubscribes, spam_reports, url, url_clicks, url_unique_clicks, url_click_through_rate)",
+            'key': "(post_id, url)",
+            'rows': []
+        },
+        'publications_table': {
+            'columns': "(publication_id, publication_name, organization_name, active_subscriptions, active_premium_subscriptions, active_free_subscriptions, average_open_rate, average_click_rate, total_sent, total_unique_opened, total_clicked)",
+            'key': "(publication_id)",
+            'rows': []
+        },
+        'segments_table': {
+            'columns': "(publication_id, publication_name, segment_id, segment_name, segment_type, last_calculated, total_results, segment_status)",
+            'key': "(publication_id, segment_id)",
+            'rows': []
+        }
+    }
+
+    for nls in beehiiv_info.values():
+        rows['publications_table']['rows'].append((
+            nls['publication_id'], 
+            nls['publication_name'], 
+            nls['organization_name'],
+            nls['active_subscriptions'], 
+            nls['active_premium_subscriptions'],
+            nls['active_free_subscriptions'], 
+            nls['average_open_rate'],
+            nls['average_click_rate'], 
+            nls['total_sent'],
+            nls['total_unique_opened'], 
+            nls['total_clicked']
+        ))
+
+        for segment in nls.get('publication_segments', []):
+            rows['segments_table']['rows'].append((
+                segment['publication_id'],
+                segment['publication_name'],
+                segment['segment_id'],
+                segment['segment_name'],
+                segment['segment_type'],
+                segment['last_calculated'],
+                segment['total_results'],
+                segment['status']
+            ))
+
+        for post in nls.get('publication_posts', []):
+            # Las columnas del post se arman una vez y se reutilizan en cada fila de unified
+            post_fields = (
+                post['post_id'],
+                post['publication_id'],
+                post['publication_name'],
+                post['publish_date'],
+                post['delivered'],
+                post['clicks'],
+                post['unique_clicks'],
+                post['click_rate'],
+                post['opens'],
+                post['unique_opens'],
+                post['open_rate'],
+                post['unsubscribes'],
+                post['spam_reports']
+            )
+            rows['newsletter_performance_table']['rows'].append(post_fields)
+
+            for url in post['urls'].values():
+                rows['url_performance_table']['rows'].append((
+                    url['post_id'],
+                    url['publication_id'],
+                    url['url'],
+                    url['url_clicks'],
+                    url['url_unique_clicks'],
+                    url['url_click_through_rate']
+                ))
+                rows['unified_performance_table']['rows'].append(post_fields + (
+                    url['url'],
+                    url['url_clicks'],
+                    url['url_unique_clicks'],
+                    url['url_click_through_rate']
+                ))
+
+    return rows
+
+# Con INSIGHT_ROLLUPS las métricas de campaign_table y ad_account_table no se suman aquí a partir de los
+# insights de cada campaña y cuenta: se calculan en la base sobre ad_set_location_table (las regiones de
+# todos los ad sets de la campaña), con cost_per_click y click_through_rate ponderados
+# (spend / clicks, clicks * 100 / impressions) en lugar de promediar las filas. reach y unique_clicks son
+# conteos de personas sin duplicar: sumarlos entre ad sets y regiones cuenta varias veces a la misma
+# persona, así que quedan en NULL. Cada consulta recalcula solo las cuentas de %(ad_account_ids)s y no
+# reescribe las filas que no cambiaron.
+INSIGHT_ROLLUP_COLUMNS = ('spend', 'clicks', 'unique_clicks', 'impressions', 'reach', 'cost_per_click', 'click_through_rate')
+_ROLLUP_AGGREGATES = (
+    "COALESCE(SUM(s.spend), 0)",
+    "COALESCE(SUM(s.clicks), 0)",
+    "NULL::numeric",
+    "COALESCE(SUM(s.impressions), 0)",
+    "NULL::numeric",
+    "SUM(s.spend)::numeric / NULLIF(SUM(s.clicks), 0)",
+    "SUM(s.clicks)::numeric * 100 / NULLIF(SUM(s.impressions), 0)"
+)
+
+def _rollup_query(table_name, id_column, source):
+    aggregates = ', '.join(f"{aggregate} AS {column}" for aggregate, column in zip(_ROLLUP_AGGREGATES, INSIGHT_ROLLUP_COLUMNS))
+    return f"""
+        UPDATE {table_name} t
+        SET {', '.join(f'{column} = r.{column}' for column in INSIGHT_ROLLUP_COLUMNS)}
+        FROM (SELECT o.{id_column}, {aggregates} FROM {source} GROUP BY o.{id_column}) r
+        WHERE t.{id_column} = r.{id_column}
+          AND ROW({', '.join(f't.{column}' for column in INSIGHT_ROLLUP_COLUMNS)}) IS DISTINCT FROM ROW({', '.join(f'r.{column}' for column in INSIGHT_ROLLUP_COLUMNS)})
+    """
+
+INSIGHT_ROLLUPS = {
+    'campaign_table': _rollup_query(
+        'campaign_table', 'campaign_id',
+        "campaign_table o LEFT JOIN ad_set_location_table s ON s.campaign_id = o.campaign_id "
+        "WHERE o.ad_account_id = ANY(%(ad_account_ids)s)"
+    ),
+    'ad_account_table': _rollup_query(
+        'ad_account_table', 'account_id',
+        "ad_account_table o LEFT JOIN campaign_table c ON c.ad_account_id = o.account_id "
+        "LEFT JOIN ad_set_location_table s ON s.campaign_id = c.campaign_id "
+        "WHERE o.account_id = ANY(%(ad_account_ids)s)"
+    )
+}
+
+def rollup_ad_account_ids(rows):
+    # Cuentas cuyas métricas se recalculan en la base: las que trae esta carga
+    if not any('rollup' in table_data for table_data in rows.values()):
+        return set()
+    return {row[0] for row in rows.get('ad_account_table', {}).get('rows', [])}
+
+@timed_stage('rows.facebook')
+def create_facebook_rows(facebook_info):
+    rows = {
+        'ad_account_table': {
+            'columns': "(account_id, name, status, currency, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, objective, created_time, updated_time)",
+            'key': "(account_id)",
+            'rows': []
+        },
+        'campaign_table': {
+            'columns': "(campaign_id, ad_account_id, name, status, objective, budget, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
+            'key': "(campaign_id)",
+            'rows': []
+        },
+        'ad_set_audience_table': {
+            'columns': "(ad_set_id, campaign_id, name, status, objective, bid_amount, bid_strategy, billing_event, budget_remaining, age_targeting, geo_targeting, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
+            'key': "(ad_set_id, age, gender)",
+            'rows': []
+        },
+        'ad_set_location_table': {
+            'columns': "(ad_set_id, campaign_id, name, status, objective, bid_amount, bid_strategy, billing_event, budget_remaining, age_targeting, geo_targeting, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
+            'key': "(ad_set_id, region, country)",
+            'rows': []
+        },
+        'ad_audience_table': {
+            'columns': "(ad_id, ad_set_id, name, status, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
+            'key': "(ad_id, age, gender)",
+            'rows': []
+        },
+        'ad_location_table': {
+            'columns': "(ad_id, ad_set_id, name, status, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, created_time, start_time, stop_time, updated_time)",
+            'key': "(ad_id, region, country)",
+            'rows': []
+        }
+    }
+
+    facebook_index = list(index_facebook_info(facebook_info or []))
+    daily = any('daily_insights_range' in account_index['ad_account'] for account_index in facebook_index)
+    # fetch_data_from_facebook_api marca las cuentas a las que no les pidió los insights de cuentas y
+    # campañas (INSIGHT_ROLLUPS, nunca con insights diarios): sus totales se calculan en la base
+    rollups = any(account_index['ad_account'].get('insight_rollups') for account_index in facebook_index)
+    if rollups:
+        rows['ad_account_table']['columns'] = "(account_id, name, status, currency, objective, created_time, updated_time)"
+        rows['campaign_table']['columns'] = "(campaign_id, ad_account_id, name, status, objective, budget, created_time, start_time, stop_time, updated_time)"
+        for table_name in INSIGHT_ROLLUPS:
+            rows[table_name]['rollup'] = INSIGHT_ROLLUPS[table_name]
+    if daily:
+        # Con insights diarios, las tablas por día reemplazan a las acumuladas de ad sets y ads
+        for table_name in ('ad_set_audience_table', 'ad_set_location_table', 'ad_audience_table', 'ad_location_table'):
+            del rows[table_name]
+        rows.update({
+            'ad_set_audience_daily_table': {
+                'columns': "(ad_set_id, campaign_id, date, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, updated_time)",
+                'key': "(ad_set_id, date, age, gender)",
+                'mode': 'upsert',
+                'delete_missing': False,
+                'rows': []
+            },
+            'ad_set_location_daily_table': {
+                'columns': "(ad_set_id, campaign_id, date, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, updated_time)",
+                'key': "(ad_set_id, date, region, country)",
+                'mode': 'upsert',
+                'delete_missing': False,
+                'rows': []
+            },
+            'ad_audience_daily_table': {
+                'columns': "(ad_id, ad_set_id, date, age, gender, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, updated_time)",
+                'key': "(ad_id, date, age, gender)",
+                'mode': 'upsert',
+                'delete_missing': False,
+                'rows': []
+            },
+            'ad_location_daily_table': {
+                'columns': "(ad_id, ad_set_id, date, region, country, spend, clicks, unique_clicks, impressions, reach, cost_per_click, click_through_rate, updated_time)",
+                'key': "(ad_id, date, region, country)",
+                'mode': 'upsert',
+                'delete_missing': False,
+                'rows': []
+            },
+            'sync_watermarks': {
+                'columns': "(object_level, object_id, last_synced_date, updated_time)",
+                'key': "(object_level, object_id)",
+                'mode': 'upsert',
+                'delete_missing': False,
+                'rows': []
+            }
+        })
+
+    # Un único timestamp para toda la corrida
+    updated_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    for account_index in facebook_index:
+        ad_account = account_index['ad_account']
+        campaigns = account_index['campaigns']
+        rows['ad_account_table']['rows'].append((
+            ad_account['id'],
+            ad_account['name'],
+            'ACTIVE',
+            ad_account['currency'],
+            *(() if rollups else summarize_insights(ad_account.get('insights_location', []))),
+            None,
+            ad_account['created_time'],
+            updated_time
+        ))
+
+        if 'daily_insights_range' in ad_account:
+            for level in DAILY_INSIGHTS_LEVELS:
+                rows['sync_watermarks']['rows'].append((
+                    level,
+                    ad_account['id'],
+                    ad_account['daily_insights_range']['until'],
+                    updated_time
+                ))
+
+        for campaign in campaigns.values():
+            rows['campaign_table']['rows'].append((
+                campaign['id'],
+                ad_account['id'],
+                campaign['name'],
+                campaign['status'],
+                campaign['objective'],
+                _object_budget(campaign),
+                *(() if rollups else summarize_insights(campaign.get('insights_location', []))),
+                campaign['created_time'],
+                campaign.get('start_time'),
+                campaign.get('stop_time'),
+                updated_time
+            ))
+
+        for ad_set in account_index['ad_sets'].values():
+            campaign = campaigns[ad_set['campaign_id']]
+            targeting = ad_set.get('targeting', {})
+            # Columnas fijas del ad set, calculadas una vez para todas sus filas de insights
+            ad_set_fields = (
+                ad_set['id'],
+                campaign['id'],
+                ad_set['name'],
+                ad_set['status'],
+                campaign['objective'],
+                float(ad_set['bid_amount']) if 'bid_amount' in ad_set else 0,
+                ad_set.get('bid_strategy'),
+                ad_set.get('billing_event'),
+                _object_budget(ad_set),
+                targeting.get('age_min'),
+                json.dumps(targeting['geo_locations']) if 'geo_locations' in targeting else None
+            )
+            ad_set_times = (ad_set['created_time'], ad_set.get('start_time'), ad_set.get('stop_time'), updated_time)
+
+            for key in INSIGHT_BREAKDOWN_COLUMNS:
+                for insight in ad_set.get(f'insights_{key}', []):
+                    rows[f'ad_set_{key}_table']['rows'].append(ad_set_fields + insight.breakdown + insight.metrics + ad_set_times)
+                for insight in ad_set.get(f'insights_daily_{key}', []):
+                    rows[f'ad_set_{key}_daily_table']['rows'].append((ad_set['id'], campaign['id'], insight.date_start) + insight.breakdown + insight.metrics + (updated_time,))
+
+        for ad in account_index['ads'].values():
+            ad_fields = (ad['id'], ad['adset_id'], ad['name'], ad['status'])
+            ad_times = (ad['created_time'], None, None, updated_time)
+
+            for key in INSIGHT_BREAKDOWN_COLUMNS:
+                for insight in ad.get(f'insights_{key}', []):
+                    rows[f'ad_{key}_table']['rows'].append(ad_fields + insight.breakdown + insight.metrics + ad_times)
+                for insight in ad.get(f'insights_daily_{key}', []):
+                    rows[f'ad_{key}_daily_table']['rows'].append((ad['id'], ad['adset_id'], insight.date_start) + insight.breakdown + insight.metrics + (updated_time,))
+
+    return rows
+
+def apply_sync_modes(rows, sync_modes=None, delete_missing=None):
+    # sync_modes puede ser un modo para todas las tablas ('replace' o 'upsert')
+    # o un dict {tabla: modo}; las tablas no listadas usan DB_SYNC_MODE.
+    default_mode = os.environ.get('DB_SYNC_MODE', DEFAULT_SYNC_MODE)
+    if isinstance(sync_modes, str):
+        default_mode, sync_modes = sync_modes, None
+    sync_modes = sync_modes or {}
+    if delete_missing is None:
+        delete_missing = os.environ.get('DB_DELETE_MISSING', 'false').lower() in ('1', 'true', 'yes')
+
+    for table_name, table_data in rows.items():
+        # Las tablas con un modo fijo en la especificación (p. ej. las diarias) lo conservan
+        table_data['mode'] = sync_modes.get(table_name, table_data.get('mode', default_mode))
+        table_data.setdefault('delete_missing', delete_missing)
+
+    return rows
+
+# Filas de cada tabla que pertenecen a una unidad (publicación o cuenta publicitaria). Las tablas de
+# ad sets y ads no tienen la cuenta: se llega a ella por campaign_table y las tablas de ad sets.
+_ACCOUNT_CAMPAIGNS = "SELECT campaign_id FROM campaign_table WHERE ad_account_id = %(unit_id)s"
+_ACCOUNT_AD_SETS = (
+    f"SELECT ad_set_id FROM ad_set_location_table WHERE campaign_id IN ({_ACCOUNT_CAMPAIGNS}) "
+    f"UNION SELECT ad_set_id FROM ad_set_audience_table WHERE campaign_id IN ({_ACCOUNT_CAMPAIGNS})"
+)
+UNIT_SCOPES = {
+    'newsletter_performance_table': "publication_id = %(unit_id)s",
+    'url_performance_table': "publication_id = %(unit_id)s",
+    'unified_performance_table': "publication_id = %(unit_id)s",
+    'publications_table': "publication_id = %(unit_id)s",
+    'segments_table': "publication_id = %(unit_id)s",
+    'ad_account_table': "account_id = %(unit_id)s",
+    'campaign_table': "ad_account_id = %(unit_id)s",
+    'ad_set_audience_table': f"campaign_id IN ({_ACCOUNT_CAMPAIGNS})",
+    'ad_set_location_table': f"campaign_id IN ({_ACCOUNT_CAMPAIGNS})",
+    'ad_audience_table': f"ad_set_id IN ({_ACCOUNT_AD_SETS})",
+    'ad_location_table': f"ad_set_id IN ({_ACCOUNT_AD_SETS})"
+}
+
+def scope_unit_rows(rows, unit_id):
+    # Un worker que carga una sola unidad solo puede borrar (delete_missing) las filas de esa unidad
+    for table_name, table_data in rows.items():
+        if table_name in UNIT_SCOPES:
+            table_data['scope'] = (UNIT_SCOPES[table_name], {'unit_id': unit_id})
+    return rows
+
+def iter_db_row_units(beehiiv_units=(), facebook_units=(), sync_modes=None, delete_missing=None, scoped=False):
+    # Convierte cada publicación / cuenta publicitaria en su propio juego de filas: ((fuente, id), filas).
+    # scoped: el borrado de filas faltantes se limita a cada unidad (ver scope_unit_rows)
+    for publication_id, publication in beehiiv_units:
+        rows = apply_sync_modes(create_beehiiv_rows({publication_id: publication}), sync_modes, delete_missing)
+        yield ('beehiiv', publication_id), scope_unit_rows(rows, publication_id) if scoped else rows
+    for ad_account in facebook_units:
+        ad_account_id = ad_account['ad_account']['id'] if 'ad_account' in ad_account else ad_account['id']
+        rows = apply_sync_modes(create_facebook_rows([ad_account]), sync_modes, delete_missing)
+        yield ('facebook', ad_account_id), scope_unit_rows(rows, ad_account_id) if scoped else rows